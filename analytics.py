@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#-------------------------------------------------------------------------------
+#  Running statistics of repeated readings, per instrument and profile
+#-------------------------------------------------------------------------------
+#
+#  Every update is O(1): session statistics use Welford's algorithm and the
+#  rolling window keeps its sums up to date as the oldest value drops out of
+#  a fixed-size ring array. No reading history is stored beyond the window.
+
+import math
+from array import array
+from collections import namedtuple
+
+## Snapshot of one series. window_* cover the last `window` values, drift is
+## the least-squares slope over the window in units per reading.
+Summary = namedtuple('Summary', 'value count mean stdev min max '
+                                'window window_mean window_stdev drift')
+
+## Keithley 2400 reports this for a reading it did not take (ie. resistance
+## when not measuring ohms)
+NOT_A_READING = 9.9e37
+
+class RunningStats(object):
+    """Count, mean, variance, min and max of all values so far (Welford)"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    @property
+    def variance(self):
+        """Sample variance, or NaN for fewer than 2 values"""
+        if self.count < 2:
+            return float('nan')
+        return self._m2 / (self.count - 1)
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+class RollingWindow(object):
+    """Mean, variance and drift of the last `size` values, kept in a ring array
+
+    The sums are updated incrementally as values enter and leave. They
+    are recomputed from the ring each time it wraps, so rounding errors
+    cannot build up over a long session; that costs O(1) per update
+    amortized.
+    """
+
+    def __init__(self, size):
+        if size < 2:
+            raise ValueError("window size must be at least 2")
+        self.size = size
+        self._ring = array('d', bytes(8 * size))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._head = 0      # index of the oldest value once full
+        self._sum = 0.0     # sum of values
+        self._sumsq = 0.0   # sum of squared deviations from the window mean
+        self._mean = 0.0
+        self._weighted = 0.0  # sum of position * value, oldest at position 0
+
+    def update(self, x):
+        n = self.count
+        if n < self.size:
+            self._ring[n] = x
+            self._weighted += n * x
+            self._sum += x
+            self.count = n + 1
+            delta = x - self._mean
+            self._mean += delta / self.count
+            self._sumsq += delta * (x - self._mean)
+            return
+
+        old = self._ring[self._head]
+        self._ring[self._head] = x
+        self._head = (self._head + 1) % n
+        ## Every remaining value moves one position towards the oldest
+        self._weighted += (n - 1) * x - (self._sum - old)
+        self._sum += x - old
+        mean = self._mean + (x - old) / n
+        self._sumsq += (x - old) * (x - mean + old - self._mean)
+        self._mean = mean
+        if self._head == 0:
+            self._recompute()
+
+    def _recompute(self):
+        values = self.values()
+        n = len(values)
+        self._sum = math.fsum(values)
+        self._mean = self._sum / n
+        self._sumsq = math.fsum((v - self._mean) ** 2 for v in values)
+        self._weighted = math.fsum(i * v for i, v in enumerate(values))
+
+    def values(self):
+        """Values in the window, oldest first"""
+        if self.count < self.size:
+            return list(self._ring[:self.count])
+        return list(self._ring[self._head:]) + list(self._ring[:self._head])
+
+    @property
+    def mean(self):
+        return self._mean if self.count else float('nan')
+
+    @property
+    def stdev(self):
+        if self.count < 2:
+            return float('nan')
+        return math.sqrt(max(self._sumsq, 0.0) / (self.count - 1))
+
+    @property
+    def drift(self):
+        """Least-squares slope over the window, in units per reading"""
+        n = self.count
+        if n < 2:
+            return float('nan')
+        sx = n * (n - 1) / 2.0
+        sxx = (n - 1) * n * (2 * n - 1) / 6.0
+        return (n * self._weighted - sx * self._sum) / (n * sxx - sx * sx)
+
+class Series(object):
+    """Session and rolling-window statistics of one quantity"""
+
+    def __init__(self, window):
+        self.session = RunningStats()
+        self.window = RollingWindow(window)
+        self.last = None
+
+    def update(self, x):
+        self.last = x
+        self.session.update(x)
+        self.window.update(x)
+
+    def reset(self):
+        self.last = None
+        self.session.reset()
+        self.window.reset()
+
+    def summary(self):
+        s = self.session
+        w = self.window
+        return Summary(self.last, s.count, s.mean if s.count else float('nan'), s.stdev,
+                       s.min, s.max, w.count, w.mean, w.stdev, w.drift)
+
+class Analytics(object):
+    """Statistics of readings kept per (instrument, profile, field)
+
+    window - values in each rolling window
+    fields - Reading fields to keep statistics of
+    """
+
+    def __init__(self, window=20, fields=('voltage', 'current')):
+        self.window = window
+        self.fields = tuple(fields)
+        self._series = {}
+
+    def add(self, instrument, profile, reading):
+        """Update the statistics with a Reading. Fields that hold no value are skipped"""
+        for field in self.fields:
+            value = getattr(reading, field)
+            if value is None or math.isnan(value) or abs(value) >= NOT_A_READING:
+                continue
+            key = (instrument, profile, field)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = Series(self.window)
+            series.update(value)
+
+    def summary(self, instrument, profile, field):
+        """Summary of one series, or None if it has no values yet"""
+        series = self._series.get((instrument, profile, field))
+        if series is None:
+            return None
+        return series.summary()
+
+    def reset(self, instrument=None, profile=None):
+        """Start new sessions for the series matching instrument and profile (None matches all)"""
+        for (inst, prof, field), series in self._series.items():
+            if instrument is not None and inst != instrument:
+                continue
+            if profile is not None and prof != profile:
+                continue
+            series.reset()
+
+def formatSummary(summary, unit=''):
+    """Two short lines for a small display: the value, then n / mean / stdev"""
+    if summary is None or summary.value is None:
+        return "", ""
+    value = "{:+.6g} {}".format(summary.value, unit).rstrip()
+    stats = "n={} μ={:.6g} σ={:.2g}".format(summary.count, summary.mean, summary.stdev)
+    return value, stats
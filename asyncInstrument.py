@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#-------------------------------------------------------------------------------
+#  asyncio front end for an Instrument
+#-------------------------------------------------------------------------------
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .tracing import tracer
+except:
+    from tracing import tracer
+
+class AsyncInstrument(object):
+    """Run an Instrument's blocking I/O off the asyncio event loop
+
+    Every call is handed to a single worker thread owned by this object,
+    so commands to the instrument stay in order and share one connection,
+    while the event loop keeps running (polling buttons, redrawing the
+    display) until the result is ready.
+    """
+
+    def __init__(self, instrument, name=None):
+        """instrument - the Instrument to drive
+        name       - name for the worker thread, defaults to the instrument class name
+        """
+        self._instrument = instrument
+        if name is None:
+            name = type(instrument).__name__
+        self._name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    @property
+    def instrument(self):
+        return self._instrument
+
+    @property
+    def name(self):
+        return self._name
+
+    async def call(self, method, *args, **kwargs):
+        """Call the named method of the instrument in the worker thread and return its result"""
+        func = functools.partial(self._call, method, args, kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func)
+
+    def _call(self, method, args, kwargs):
+        with tracer.span(method, 'call', self._name):
+            return getattr(self._instrument, method)(*args, **kwargs)
+
+    async def open(self):
+        return await self.call('open')
+
+    async def close(self):
+        return await self.call('close')
+
+    async def query(self, queryStr):
+        return await self.call('query', queryStr)
+
+    async def write(self, writeStr):
+        return await self.call('write', writeStr)
+
+    async def setup(self):
+        return await self.call('setup')
+
+    async def action(self):
+        return await self.call('action')
+
+    async def shutdown(self):
+        """Release the instrument's connection and stop the worker thread"""
+        try:
+            await self.call('shutdown')
+        finally:
+            self._executor.shutdown(wait=False)
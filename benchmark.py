@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#-------------------------------------------------------------------------------
+#  Press-to-reading latency benchmark against the simulated Keithley 2400
+#-------------------------------------------------------------------------------
+#
+#      python benchmark.py [--actions 20] [--speed 1] [--jitter 0.002] [--drop 0] [--transport tcp]
+#                          [--trace trace.json]
+#
+#  For every combination of connection mode and pacing policy, reports the
+#  time _setup() takes, the p50/p99 latency of action(), the sustained
+#  actions per second and how many actions failed on a dropped link. It
+#  exits with status 1 if adaptive pacing is not faster than fixed pacing.
+
+import math
+import time
+import argparse
+
+try:
+    from . import instKeithley2400
+except:
+    from instKeithley2400 import Keithley2400
+
+try:
+    from . import pacing
+except:
+    from pacing import FixedPacing, OpcPacing, AdaptivePacing
+
+try:
+    from . import simKeithley2400
+except:
+    from simKeithley2400 import SimServer, HANDLERS
+
+try:
+    from . import tracing
+except:
+    from tracing import tracer
+
+## Connection modes: name -> Keithley2400 keyword arguments
+CONNECTIONS = {
+    'per-action': {'persistent': False},
+    'persistent': {'persistent': True},
+}
+
+## Pacing policies: name -> factory
+PACINGS = {
+    'fixed': lambda: FixedPacing(0.3),
+    'opc': OpcPacing,
+    'adaptive': AdaptivePacing,
+}
+
+def percentile(samples, p):
+    """p-th percentile (0-100) of samples, nearest rank"""
+    ordered = sorted(samples)
+    rank = min(len(ordered) - 1, max(0, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+def run(url, connection, pacing, actions):
+    """Benchmark one configuration. Returns dict of results in seconds"""
+    device = Keithley2400(url, pacing=PACINGS[pacing](), **CONNECTIONS[connection])
+    try:
+        start = time.monotonic()
+        device.setup()
+        setup = time.monotonic() - start
+
+        latencies = []
+        failures = 0
+        start = time.monotonic()
+        for i in range(actions):
+            t = time.monotonic()
+            try:
+                device.action()
+            except device._connection_errors:
+                ## Dropped link: count it, the next action reconnects
+                failures += 1
+                continue
+            latencies.append(time.monotonic() - t)
+        total = time.monotonic() - start
+    finally:
+        device.shutdown()
+
+    return {
+        'setup': setup,
+        'p50': percentile(latencies, 50) if latencies else float('nan'),
+        'p99': percentile(latencies, 99) if latencies else float('nan'),
+        'rate': len(latencies) / total,
+        'failures': failures,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Footswitch latency benchmark on a simulated Keithley 2400")
+    parser.add_argument('--actions', type=int, default=20, help="actions per configuration")
+    parser.add_argument('--speed', type=float, default=1.0, help="simulated instrument delay divisor")
+    parser.add_argument('--jitter', type=float, default=0.0, help="max seconds of reply jitter")
+    parser.add_argument('--drop', type=float, default=0.0, help="probability of dropping the link per message")
+    parser.add_argument('--transport', choices=sorted(HANDLERS), action='append',
+                        help="transport(s) the simulator serves, default all")
+    parser.add_argument('--connection', choices=sorted(CONNECTIONS), action='append',
+                        help="connection mode(s) to run, default all")
+    parser.add_argument('--pacing', choices=sorted(PACINGS), action='append',
+                        help="pacing policy(s) to run, default all")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="trace every configuration, print a summary of each and "
+                        "write the spans of the last as a Chrome trace to FILE")
+    args = parser.parse_args(argv)
+    tracer.enable(args.trace is not None)
+
+    results = {}
+    print("{:<9} {:<12} {:<9} {:>9} {:>9} {:>9} {:>10} {:>8}".format(
+        'transport', 'connection', 'pacing', 'setup ms', 'p50 ms', 'p99 ms', 'actions/s', 'failures'))
+    for transport in args.transport or sorted(HANDLERS, reverse=True):
+        server = SimServer(speed=args.speed, jitter=args.jitter, drop=args.drop, seed=1,
+                           transport=transport).start()
+        try:
+            for connection in args.connection or list(CONNECTIONS):
+                for pacing in args.pacing or list(PACINGS):
+                    server.meter.reset()
+                    tracer.clear()
+                    r = results[(transport, connection, pacing)] = run(
+                        server.url, connection, pacing, args.actions)
+                    print("{:<9} {:<12} {:<9} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.2f} {:>8}".format(
+                        transport, connection, pacing, r['setup'] * 1e3, r['p50'] * 1e3,
+                        r['p99'] * 1e3, r['rate'], r['failures']))
+                    if args.trace is not None:
+                        print(tracer.summary() + '\n')
+        finally:
+            server.stop()
+    if args.trace is not None:
+        tracer.dump(args.trace)
+
+    slower = checkAdaptive(results)
+    for transport, connection, adaptive, fixed in slower:
+        print("adaptive pacing is no faster than fixed over {} {}: p50 {:.1f} ms vs {:.1f} ms".format(
+            transport, connection, adaptive * 1e3, fixed * 1e3))
+    return 1 if slower else 0
+
+def checkAdaptive(results):
+    """Configurations where adaptive pacing's p50 latency is not below fixed pacing's
+
+    results - {(transport, connection, pacing): run() result}
+    Returns a list of (transport, connection, adaptive p50, fixed p50).
+    """
+    slower = []
+    for (transport, connection, pacing), r in sorted(results.items()):
+        fixed = results.get((transport, connection, 'fixed'))
+        if pacing != 'adaptive' or fixed is None:
+            continue
+        if not r['p50'] < fixed['p50']:
+            slower.append((transport, connection, r['p50'], fixed['p50']))
+    return slower
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#-------------------------------------------------------------------------------
+#  Start-up time report: where the time to the first usable press goes
+#-------------------------------------------------------------------------------
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+def processAge():
+    """Seconds since this process started, from /proc, or None where that is not available"""
+    try:
+        with open('/proc/self/stat') as f:
+            ## Field 22, counted after the command name, which may contain spaces
+            start = int(f.read().rpartition(')')[2].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class BootTimer(object):
+    """Record named phases of start-up, possibly overlapping, and report them"""
+
+    def __init__(self):
+        self._origin = time.monotonic()
+        ## Time the interpreter took before the first line of footswitch ran
+        self.before = processAge()
+        self._phases = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time the block as phase name (safe to use from several threads)"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._phases.append((name, start - self._origin, time.monotonic() - start))
+
+    def elapsed(self):
+        return time.monotonic() - self._origin
+
+    def report(self, width=40):
+        """Text table of the phases: start offset, duration and a bar on a common time line"""
+        total = self.elapsed()
+        lines = []
+        if self.before is not None:
+            lines.append("{:<24} {:>9.1f} ms before footswitch code ran".format(
+                'interpreter', self.before * 1e3))
+        scale = width / total if total > 0 else 0
+        for name, start, duration in sorted(self._phases, key=lambda p: p[1]):
+            bar = ' ' * int(start * scale) + '#' * max(1, int(duration * scale))
+            lines.append("{:<24} {:>9.1f} ms at {:>7.1f} ms |{:<{w}}|".format(
+                name, duration * 1e3, start * 1e3, bar[:width], w=width))
+        lines.append("{:<24} {:>9.1f} ms".format('ready for first press', total * 1e3))
+        return '\n'.join(lines)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#-------------------------------------------------------------------------------
+#  Edge driven button input with software debounce
+#-------------------------------------------------------------------------------
+
+import os
+import time
+import select
+import threading
+from collections import deque, namedtuple
+
+## BCM line offsets of the bonnet buttons on the Pi's GPIO chip
+BONNET_PINS = {'A': 5, 'B': 6, 'L': 27, 'R': 23, 'U': 17, 'D': 22, 'C': 4}
+
+## A debounced change of a button. timestamp is CLOCK_MONOTONIC in ns.
+ButtonEvent = namedtuple('ButtonEvent', 'name pressed timestamp')
+
+class GpioEdgeSource(object):
+    """Raw edges from GPIO lines through the Linux gpio character device
+
+    Requires the libgpiod v2 Python bindings (python3-libgpiod / gpiod on PyPI).
+    Buttons are active low with the internal pull-ups enabled.
+    """
+
+    def __init__(self, pins=BONNET_PINS, chip='/dev/gpiochip0', consumer='footswitch'):
+        """pins - dict of button name to line offset
+        chip - gpio character device the lines belong to
+        """
+        import gpiod
+        from gpiod.line import Bias, Edge, Value
+
+        self._names = {offset: name for name, offset in pins.items()}
+        self._high = Value.ACTIVE
+        self._rising = gpiod.EdgeEvent.Type.RISING_EDGE
+        settings = gpiod.LineSettings(edge_detection=Edge.BOTH, bias=Bias.PULL_UP)
+        self._request = gpiod.request_lines(chip, consumer=consumer,
+                                            config={tuple(self._names): settings})
+
+    def fileno(self):
+        return self._request.fd
+
+    def levels(self):
+        """Return dict of button name to present line level, True if high (released)"""
+        offsets = list(self._names)
+        values = self._request.get_values(offsets)
+        return {self._names[offset]: value == self._high for offset, value in zip(offsets, values)}
+
+    def read(self):
+        """Return list of (name, level, timestamp_ns) for edges waiting to be read"""
+        edges = []
+        while self._request.wait_edge_events(0):
+            for event in self._request.read_edge_events():
+                edges.append((self._names[event.line_offset],
+                              event.event_type == self._rising,
+                              event.timestamp_ns))
+        return edges
+
+    def close(self):
+        self._request.release()
+
+class FakeEdgeSource(object):
+    """Stand-in for GpioEdgeSource that is driven from software
+
+    Edges are injected with press()/release() (from any thread) and wake
+    up a select() on fileno() just like real GPIO edges, so the whole
+    input path runs on a plain Linux box.
+    """
+
+    def __init__(self, names=tuple(BONNET_PINS)):
+        self._levels = {name: True for name in names}
+        self._edges = deque()
+        self._lock = threading.Lock()
+        self._rfd, self._wfd = os.pipe()
+        os.set_blocking(self._rfd, False)
+
+    def fileno(self):
+        return self._rfd
+
+    def levels(self):
+        with self._lock:
+            return dict(self._levels)
+
+    def inject(self, name, level, timestamp=None):
+        """Queue an edge of button name to level (True is high, released)"""
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        with self._lock:
+            self._levels[name] = level
+            self._edges.append((name, level, timestamp))
+        os.write(self._wfd, b'\0')
+
+    def press(self, name, timestamp=None):
+        self.inject(name, False, timestamp)
+
+    def release(self, name, timestamp=None):
+        self.inject(name, True, timestamp)
+
+    def read(self):
+        try:
+            while os.read(self._rfd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            edges = list(self._edges)
+            self._edges.clear()
+        return edges
+
+    def close(self):
+        os.close(self._rfd)
+        os.close(self._wfd)
+
+class ButtonInput(object):
+    """Debounce raw edges from an edge source into button press/release events
+
+    The first edge that changes a button's state is reported at once and
+    edges in the following `debounce` seconds are treated as bounce. If
+    the line has settled in the other state once the window is over, that
+    change is reported then, so a short tap is never lost.
+    """
+
+    def __init__(self, source, debounce=0.02):
+        """source   - GpioEdgeSource, FakeEdgeSource or anything with fileno(), levels() and read()
+        debounce - seconds to ignore further edges after a change of state
+        """
+        self._source = source
+        self._debounce = int(debounce * 1e9)
+        now = time.monotonic_ns()
+        self._pressed = {name: not level for name, level in source.levels().items()}
+        self._raw = dict(self._pressed)
+        self._raw_time = {name: now for name in self._pressed}
+        self._changed = {name: now - self._debounce for name in self._pressed}
+
+    @property
+    def names(self):
+        return tuple(self._pressed)
+
+    def fileno(self):
+        return self._source.fileno()
+
+    def pressed(self, name):
+        """True if the button is currently (debounced) pressed"""
+        return self._pressed[name]
+
+    def deadline(self):
+        """Seconds until a bouncing button settles and must be read again, or None"""
+        deadline = None
+        for name, raw in self._raw.items():
+            if raw != self._pressed[name]:
+                due = max(self._raw_time[name], self._changed[name]) + self._debounce
+                if deadline is None or due < deadline:
+                    deadline = due
+        if deadline is None:
+            return None
+        return max(0.0, (deadline - time.monotonic_ns()) / 1e9)
+
+    def wait(self, timeout=None):
+        """Sleep until an edge arrives or timeout seconds pass and return the new ButtonEvents
+
+        timeout - seconds to wait at most, None to wait until something happens
+        """
+        deadline = self.deadline()
+        if deadline is not None and (timeout is None or deadline < timeout):
+            timeout = deadline
+        select.select([self._source], [], [], timeout)
+        return self.read()
+
+    def read(self):
+        """Return the ButtonEvents for edges received so far, without waiting"""
+        events = []
+        for name, level, timestamp in self._source.read():
+            self._raw[name] = not level
+            self._raw_time[name] = timestamp
+            if (not level) != self._pressed[name] and timestamp - self._changed[name] >= self._debounce:
+                self._change(name, timestamp, events)
+
+        now = time.monotonic_ns()
+        for name, raw in self._raw.items():
+            if (raw != self._pressed[name] and
+                now - self._raw_time[name] >= self._debounce and
+                now - self._changed[name] >= self._debounce):
+                self._change(name, now, events)
+        return events
+
+    def _change(self, name, timestamp, events):
+        self._pressed[name] = not self._pressed[name]
+        self._changed[name] = timestamp
+        events.append(ButtonEvent(name, self._pressed[name], timestamp))
+
+    def close(self):
+        self._source.close()
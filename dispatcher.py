@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#-------------------------------------------------------------------------------
+#  Dispatch button presses to actions on one or more instruments
+#-------------------------------------------------------------------------------
+
+import asyncio
+import json
+
+try:
+    from .asyncInstrument import AsyncInstrument
+except:
+    from asyncInstrument import AsyncInstrument
+
+try:
+    from .tracing import tracer
+except:
+    from tracing import tracer
+
+## Buttons on the footswitch, as named by the UI callbacks (onButtonA, ...)
+BUTTONS = ('A', 'B', 'L', 'R', 'U', 'C', 'D')
+
+## Button edges a binding can act on
+EDGES = ('press', 'release')
+
+class Binding(object):
+    """One instrument action triggered by a button"""
+
+    def __init__(self, instrument, action='action', args=None, on='press'):
+        """instrument - name of the instrument in the dispatcher
+        action     - name of the instrument method to call
+        args       - dict of keyword arguments for the method
+        on         - 'press' to act when the button goes down, 'release' when it comes up
+        """
+        if on not in EDGES:
+            raise ValueError("on must be one of {}".format(', '.join(EDGES)))
+        self.instrument = instrument
+        self.action = action
+        self.args = {} if args is None else dict(args)
+        self.on = on
+
+    def __repr__(self):
+        return "Binding({!r}, {!r}, {!r}, on={!r})".format(self.instrument, self.action,
+                                                            self.args, self.on)
+
+class Dispatcher(object):
+    """Map footswitch buttons to instrument actions and run them concurrently
+
+    Each instrument gets its own worker thread and connection (see
+    AsyncInstrument), so a button bound to several instruments waits only
+    as long as the slowest of them. Actions on the same instrument run
+    one after the other in press order. Each button queues at most
+    max_pending presses while its actions are in flight; further presses
+    are coalesced into those already waiting. Bindings with on='release'
+    run when the button comes up, queued the same way.
+    """
+
+    def __init__(self, instruments, buttons, onResult=None, onError=None, max_pending=1):
+        """instruments - dict of name to Instrument
+        buttons     - dict of button name ('A', 'B', ...) to list of Binding
+        onResult    - called as onResult(button, instrument_name, result) for each completed action
+        onError     - called as onError(button, instrument_name, exception) for each failed action
+        max_pending - presses of one button that may wait while its actions run
+        """
+        for button, bindings in buttons.items():
+            if button not in BUTTONS:
+                raise ValueError("Unknown button '{}'".format(button))
+            for binding in bindings:
+                if binding.instrument not in instruments:
+                    raise ValueError("Button {} uses unknown instrument '{}'".format(
+                        button, binding.instrument))
+                if not callable(getattr(instruments[binding.instrument], binding.action, None)):
+                    raise ValueError("Instrument '{}' has no action '{}'".format(
+                        binding.instrument, binding.action))
+
+        self._instruments = {name: AsyncInstrument(inst, name) for name, inst in instruments.items()}
+        self._buttons = {button: list(bindings) for button, bindings in buttons.items() if bindings}
+        ## (button, edge) -> bindings acting on that edge
+        self._edges = {}
+        for button, bindings in self._buttons.items():
+            for binding in bindings:
+                self._edges.setdefault((button, binding.on), []).append(binding)
+        self._onResult = onResult if onResult is not None else self._printResult
+        self._onError = onError if onError is not None else self._printError
+        self._queues = {key: asyncio.Queue(maxsize=max_pending) for key in self._edges}
+
+    @classmethod
+    def load(cls, path, drivers, **kwargs):
+        """Create a Dispatcher from a JSON configuration file
+
+        path    - configuration file, see footswitch.example.json
+        drivers - dict of driver name to Instrument class
+        kwargs  - passed on to Dispatcher()
+        """
+        with open(path) as f:
+            config = json.load(f)
+
+        instruments = {}
+        for name, spec in config.get('instruments', {}).items():
+            driver = spec['driver']
+            if driver not in drivers:
+                raise ValueError("Instrument '{}' uses unknown driver '{}'".format(name, driver))
+            instruments[name] = drivers[driver](spec['resource'], **spec.get('options', {}))
+
+        buttons = {}
+        for button, bindings in config.get('buttons', {}).items():
+            if isinstance(bindings, dict):
+                bindings = [bindings]
+            buttons[button] = [Binding(b['instrument'], b.get('action', 'action'), b.get('args'),
+                                       b.get('on', 'press'))
+                               for b in bindings]
+
+        return cls(instruments, buttons, **kwargs)
+
+    @property
+    def instruments(self):
+        return self._instruments
+
+    @property
+    def buttons(self):
+        return tuple(self._buttons)
+
+    def callbacks(self):
+        """Return keyword arguments for UI() that route the mapped buttons here"""
+        callbacks = {'onButton' + button: (lambda button=button: self.press(button))
+                     for button, edge in self._edges if edge == 'press'}
+        if any(edge == 'release' for _, edge in self._edges):
+            callbacks['onRelease'] = self.release
+        return callbacks
+
+    def press(self, button):
+        """Queue a press of button. Safe to call from UI callbacks on the event loop"""
+        self._queue(button, 'press')
+
+    def release(self, button):
+        """Queue a release of button. Safe to call from UI callbacks on the event loop"""
+        self._queue(button, 'release')
+
+    def _queue(self, button, edge):
+        queue = self._queues.get((button, edge))
+        if queue is None:
+            return
+        try:
+            queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass  # already pending, that dispatch will answer this press too
+
+    async def setup(self):
+        """Set up all instruments concurrently"""
+        await asyncio.gather(*(inst.setup() for inst in self._instruments.values()))
+
+    async def dispatch(self, button, edge='press'):
+        """Run every action bound to edge ('press' or 'release') of button concurrently
+
+        Returns the list of results.
+        """
+        bindings = self._edges.get((button, edge), [])
+        with tracer.span('dispatch', 'dispatcher', button + ' ' + edge):
+            results = await asyncio.gather(
+                *(self._instruments[b.instrument].call(b.action, **b.args) for b in bindings),
+                return_exceptions=True)
+        for binding, result in zip(bindings, results):
+            if isinstance(result, Exception):
+                self._onError(button, binding.instrument, result)
+            else:
+                self._onResult(button, binding.instrument, result)
+        return results
+
+    async def run(self):
+        """Serve button presses until cancelled"""
+        await asyncio.gather(*(self._serve(button, edge) for button, edge in self._queues))
+
+    async def _serve(self, button, edge):
+        queue = self._queues[(button, edge)]
+        while True:
+            await queue.get()
+            try:
+                await self.dispatch(button, edge)
+            finally:
+                queue.task_done()
+
+    async def shutdown(self):
+        """Release every instrument connection"""
+        await asyncio.gather(*(inst.shutdown() for inst in self._instruments.values()),
+                             return_exceptions=True)
+
+    def _printResult(self, button, name, result):
+        print("{} {}: {}".format(button, name, result))
+
+    def _printError(self, button, name, exc):
+        print("{} {} failed: {}".format(button, name, exc))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#-------------------------------------------------------------------------------
+#  Registry of instrument drivers, imported only when first used
+#-------------------------------------------------------------------------------
+#
+#  A configuration file names drivers (see footswitch.example.json). Each is
+#  declared here as "module:Class" and its module, with whatever libraries it
+#  pulls in, is imported the first time the driver is looked up, so start-up
+#  pays only for the drivers the configuration actually uses.
+
+import importlib
+from collections.abc import Mapping
+
+## Driver name -> "module:Class"
+DRIVERS = {
+    'Keithley2400': 'instKeithley2400:Keithley2400',
+}
+
+def importObject(spec):
+    """Import "module:name" and return the named object
+
+    The module is looked up next to this one first (when footswitch is
+    used as a package), then as a top level module.
+    """
+    module, _, name = spec.partition(':')
+    if __package__:
+        try:
+            return getattr(importlib.import_module('.' + module, __package__), name)
+        except ImportError:
+            pass
+    return getattr(importlib.import_module(module), name)
+
+class DriverRegistry(Mapping):
+    """Mapping of driver name to Instrument class that imports each class on first access"""
+
+    def __init__(self, drivers=DRIVERS):
+        self._specs = dict(drivers)
+        self._classes = {}
+
+    def register(self, name, spec):
+        """Declare driver name as spec: "module:Class" or the class itself"""
+        self._specs[name] = spec
+        self._classes.pop(name, None)
+
+    def __getitem__(self, name):
+        cls = self._classes.get(name)
+        if cls is None:
+            spec = self._specs[name]
+            cls = importObject(spec) if isinstance(spec, str) else spec
+            self._classes[name] = cls
+        return cls
+
+    def __contains__(self, name):
+        ## Without importing anything
+        return name in self._specs
+
+    def __iter__(self):
+        return iter(self._specs)
+
+    def __len__(self):
+        return len(self._specs)
+
+    def loaded(self):
+        """Names of the drivers imported so far"""
+        return tuple(self._classes)
+
+## The drivers footswitch knows about
+registry = DriverRegistry()
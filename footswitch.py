@@ -26,33 +26,224 @@
 #  Main operation of footswitch
 #-------------------------------------------------------------------------------
 
+import os
+import asyncio
+import argparse
+
+try:
+    from . import bootTimer
+except:
+    from bootTimer import BootTimer
+
+## Started before anything heavy is imported, see --startup-report
+boot = BootTimer()
+
+try:
+    from . import drivers
+except:
+    from drivers import registry
+
+try:
+    from . import dispatcher
+except:
+    from dispatcher import Dispatcher, Binding
+
+try:
+    from . import readings
+except:
+    from readings import Reading, formatReading
+
+try:
+    from . import measurementLog
+except:
+    from measurementLog import MeasurementLog
+
+try:
+    from . import profiles
+except:
+    from profiles import Profile
+
+try:
+    from . import analytics
+except:
+    from analytics import Analytics
+
 try:
-    from . import instKeithley2400
+    from . import hidKeyboard
 except:
-    from instKeithley2400 import Keithley2400
+    from hidKeyboard import HidKeyboard
 
 try:
-    from . import ui
+    from . import tracing
 except:
-    from ui import UI
+    from tracing import tracer
+
+## The display and GPIO modules (board, PIL, adafruit_rgb_display) are
+## imported by makeUI(), while the instruments are being set up
+
+## Longest time between display refreshes when no button is touched, so
+## widgets changed by completed actions still show up
+DISPLAY_INTERVAL = 0.1
+
+## Every reading is also written here, one file per day (see measurementLog.py)
+LOG_DIR = os.path.expanduser("~/footswitch-log")
+
+## Measurement profiles of the default configuration, stepped through with U and D
+PROFILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles.json")
+
+## Reading field shown on the display with its statistics, and its unit
+DISPLAY_FIELD = ('voltage', 'V')
+
+## Readings in the rolling window of the statistics
+STATS_WINDOW = 20
+
+## USB HID keyboard gadget every reading is typed on, if present
+HID_DEVICE = "/dev/hidg0"
+
+## Reading fields typed on the host, tab separated, one reading per line
+HID_FIELDS = ('voltage',)
+
+## Instrument drivers that a configuration file may name, each imported on first use
+DRIVERS = registry
 
-device = None
+def defaultDispatcher(**kwargs):
+    """Button A reads the Keithley 2400 on the wifi-uart bridge, U and D change its profile"""
+    ## Keep the websocket open between presses so a press costs only the measurement
+    device = DRIVERS['Keithley2400']("ws://wifi-uart.crozet.lan:8000",
+                          persistent=True, keepalive=20.0, idle_timeout=600.0,
+                          profiles=PROFILES)
+    return Dispatcher({'dmm': device},
+                      {'A': [Binding('dmm')],
+                       'U': [Binding('dmm', 'stepProfile', {'step': -1})],
+                       'D': [Binding('dmm', 'stepProfile', {'step': 1})]},
+                      **kwargs)
+
+measurements = None
+keyboard = None
+display = None
+instruments = {}
+stats = Analytics(window=STATS_WINDOW)
+
+def onResult(button, name, result):
+    if isinstance(result, Reading):
+        result = [result]
+    if isinstance(result, list):
+        profile = instruments[name].profile if name in instruments else None
+        for reading in result:
+            print(formatReading(reading))
+            stats.add(name, profile, reading)
+            if measurements is not None:
+                measurements.log(name, button, reading, profile=profile or '')
+        if keyboard is not None and result:
+            if not keyboard.typeReadings(result, fields=HID_FIELDS):
+                print("{} {}: HID keyboard queue full, {} reading(s) not typed".format(
+                    button, name, len(result)))
+        if display is not None and result:
+            field, unit = DISPLAY_FIELD
+            display.showStats(stats.summary(name, profile, field), unit)
+            ## Results arrive on the event loop: show them now rather than
+            ## on runButtons' next timeout
+            display.refresh()
+    elif isinstance(result, Profile):
+        print("{}: profile {}".format(name, result.name))
+        if display is not None:
+            display.showProfile(result.name)
+            field, unit = DISPLAY_FIELD
+            display.showStats(stats.summary(name, result.name, field), unit)
+            display.refresh()
+    elif result is not None:
+        print(result)
 
-def onButtonA():
-    if device is not None:
-        line = device.action()
-        print(line)
-    
 def onButtonB():
-    print("Button B!")
-    
+    """Start a new statistics session"""
+    stats.reset()
+    if display is not None:
+        display.showStats(None)
+
+async def runButtons(bonnet):
+    """Handle button edges as they arrive, keeping the display live while actions are in flight"""
+    loop = asyncio.get_running_loop()
+    edge = asyncio.Event()
+    loop.add_reader(bonnet.fileno(), edge.set)
+    try:
+        while True:
+            timeout = bonnet.deadline()
+            if timeout is None or timeout > DISPLAY_INTERVAL:
+                timeout = DISPLAY_INTERVAL
+            try:
+                await asyncio.wait_for(edge.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            edge.clear()
+            bonnet.poll(0)
+    finally:
+        loop.remove_reader(bonnet.fileno())
+
+def makeUI(callbacks):
+    """Import the display and button modules and create the UI"""
+    with boot.phase('import ui'):
+        try:
+            from .ui import UI
+        except:
+            from ui import UI
+    with boot.phase('create ui'):
+        return UI(**callbacks)
+
+async def main(config=None, startup_report=False, trace=None):
+    """trace - path of a Chrome trace JSON file to write the hot path spans to on exit"""
+    global measurements, keyboard, display
+    if trace is not None:
+        tracer.enable()
+    with boot.phase('open log'):
+        measurements = MeasurementLog(LOG_DIR)
+        if os.path.exists(HID_DEVICE):
+            keyboard = HidKeyboard(HID_DEVICE)
+    with boot.phase('load drivers'):
+        if config is None:
+            switch = defaultDispatcher(onResult=onResult)
+        else:
+            switch = Dispatcher.load(config, DRIVERS, onResult=onResult)
+    instruments.update((name, device.instrument) for name, device in switch.instruments.items())
+    try:
+        callbacks = {'onButtonB': onButtonB}
+        callbacks.update(switch.callbacks())
+        ## Bring up the display while the instruments are set up
+        loop = asyncio.get_running_loop()
+        with boot.phase('setup + ui'):
+            bonnet, _ = await asyncio.gather(loop.run_in_executor(None, makeUI, callbacks),
+                                             timedSetup(switch))
+        if startup_report:
+            print(boot.report())
+        for device in instruments.values():
+            if device.profile is not None:
+                bonnet.showProfile(device.profile)
+                break
+        display = bonnet
+        await asyncio.gather(runButtons(bonnet), switch.run())
+    finally:
+        await switch.shutdown()
+        measurements.close()
+        if keyboard is not None:
+            keyboard.close()
+        if trace is not None:
+            tracer.dump(trace)
+            print(tracer.summary())
+
+async def timedSetup(switch):
+    with boot.phase('instrument setup'):
+        await switch.setup()
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Footswitch operated instrument controller")
+    parser.add_argument('config', nargs='?', help="JSON file mapping buttons to instrument actions")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="print where start-up time went once buttons are live")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="record button, instrument and display spans and write them to FILE "
+                        "as a Chrome trace on exit")
+    args = parser.parse_args()
     try:
-        device = Keithley2400("ws://wifi-uart.crozet.lan:8000")
-        device.setup()
-        bonnet = UI(onButtonA=onButtonA, onButtonB=onButtonB)
-        bonnet.loop()
+        asyncio.run(main(args.config, args.startup_report, args.trace))
 
     except (KeyboardInterrupt, SystemExit):
         exit(2)
-
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#-------------------------------------------------------------------------------
+#  Type text on the host through the Pi's USB HID keyboard gadget
+#-------------------------------------------------------------------------------
+#
+#  /dev/hidgN of a configfs HID function with the standard boot keyboard
+#  report descriptor takes 8 byte reports: modifiers, reserved, 6 key codes.
+#  Each character is typed as a key-down report followed by an all-keys-up
+#  report. Both are looked up in tables built once at import.
+
+import os
+import time
+import tempfile
+import threading
+from collections import deque
+
+REPORT_SIZE = 8
+LEFT_SHIFT = 0x02
+
+## All keys up
+RELEASE = bytes(REPORT_SIZE)
+
+def _keycodes():
+    """(modifier, usage id) of every character a US layout keyboard can type"""
+    codes = {}
+    for i, c in enumerate('abcdefghijklmnopqrstuvwxyz'):
+        codes[c] = (0, 0x04 + i)
+        codes[c.upper()] = (LEFT_SHIFT, 0x04 + i)
+    for i, (c, shifted) in enumerate(zip('1234567890', '!@#$%^&*()')):
+        codes[c] = (0, 0x1E + i)
+        codes[shifted] = (LEFT_SHIFT, 0x1E + i)
+    for usage, c, shifted in ((0x2D, '-', '_'), (0x2E, '=', '+'), (0x2F, '[', '{'),
+                              (0x30, ']', '}'), (0x31, '\\', '|'), (0x33, ';', ':'),
+                              (0x34, "'", '"'), (0x35, '`', '~'), (0x36, ',', '<'),
+                              (0x37, '.', '>'), (0x38, '/', '?')):
+        codes[c] = (0, usage)
+        codes[shifted] = (LEFT_SHIFT, usage)
+    codes['\n'] = (0, 0x28)  # Enter
+    codes['\t'] = (0, 0x2B)
+    codes[' '] = (0, 0x2C)
+    return codes
+
+## character -> key-down report followed by the key-up report
+KEYSTROKES = {c: bytes((mod, 0, usage, 0, 0, 0, 0, 0)) + RELEASE
+              for c, (mod, usage) in _keycodes().items()}
+
+## key-down report -> character, for reading back what was typed
+_CHARACTERS = {stroke[:REPORT_SIZE]: c for c, stroke in KEYSTROKES.items()}
+
+def encode(text):
+    """Reports that type text. Raises ValueError for a character that cannot be typed"""
+    try:
+        return b''.join([KEYSTROKES[c] for c in text])
+    except KeyError as e:
+        raise ValueError("Cannot type {!r} on the HID keyboard".format(e.args[0]))
+
+def decode(data):
+    """Text typed by a sequence of reports (key-up reports are skipped)"""
+    text = []
+    for i in range(0, len(data) - REPORT_SIZE + 1, REPORT_SIZE):
+        report = bytes(data[i:i + REPORT_SIZE])
+        if report != RELEASE:
+            text.append(_CHARACTERS.get(report, '\ufffd'))
+    return ''.join(text)
+
+def readingText(reading, fields=('voltage',), sep='\t', end='\n'):
+    """Text typed for a Reading: the chosen fields in scientific notation
+
+    The default tab and newline move a spreadsheet to the next cell and row.
+    Fields without a value are typed empty.
+    """
+    values = []
+    for field in fields:
+        value = getattr(reading, field)
+        values.append('' if value is None else '{:+.6E}'.format(value))
+    return sep.join(values) + end
+
+class HidKeyboard(object):
+    """Type text on the host without ever blocking the caller
+
+    type() encodes the text and puts it on a bounded queue; a writer
+    thread sends the reports to the HID gadget one at a time, so a host
+    that is slow to poll (or not plugged in) holds up only that thread.
+    """
+
+    def __init__(self, device='/dev/hidg0', maxsize=64, interval=0.0, retry=1.0):
+        """device   - HID gadget device (or any file, see FakeHidDevice)
+        maxsize  - texts the queue holds; type() drops the text when full
+        interval - seconds to wait between reports, 0 to rely on the gadget
+                   blocking until the host has taken the previous report
+        retry    - seconds to wait before reopening the device after an error
+        """
+        self._device = device
+        self._maxsize = maxsize
+        self._interval = interval
+        self._retry = retry
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._busy = False
+        self.dropped = 0
+        self.errors = 0
+
+        self._file = None
+        self._thread = threading.Thread(target=self._writer, name="hidKeyboard", daemon=True)
+        self._thread.start()
+
+    def type(self, text):
+        """Queue text to be typed. Returns False if it was dropped because the queue is full"""
+        data = encode(text)
+        with self._cond:
+            if self._closed:
+                raise ValueError("keyboard is closed")
+            if len(self._queue) >= self._maxsize:
+                self.dropped += 1
+                return False
+            self._queue.append(data)
+            self._cond.notify_all()
+            return True
+
+    def typeReading(self, reading, **kwargs):
+        """Queue a Reading to be typed, formatted by readingText(reading, **kwargs)"""
+        return self.type(readingText(reading, **kwargs))
+
+    def typeReadings(self, readings, **kwargs):
+        """Queue Readings to be typed as one text, so a whole capture takes one queue slot"""
+        return self.type(''.join(readingText(reading, **kwargs) for reading in readings))
+
+    def flush(self, timeout=None):
+        """Wait until everything queued has been typed. Returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self, timeout=5.0):
+        """Type what is queued (waiting at most timeout seconds) and stop the writer thread"""
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    self._closeDevice()
+                    return
+                data = self._queue.popleft()
+                self._busy = True
+            try:
+                self._send(data)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _send(self, data):
+        view = memoryview(data)
+        try:
+            if self._file is None:
+                self._file = open(self._device, 'wb', buffering=0)
+                ## Let go of any key left down by a text cut short
+                self._file.write(RELEASE)
+            for i in range(0, len(view), REPORT_SIZE):
+                self._file.write(view[i:i + REPORT_SIZE])
+                if self._interval:
+                    time.sleep(self._interval)
+        except OSError:
+            ## Host unplugged or gadget not bound: lose this text, try again later
+            self.errors += 1
+            self._closeDevice()
+            time.sleep(self._retry)
+
+    def _closeDevice(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+class FakeHidDevice(object):
+    """A regular file standing in for /dev/hidgN, so HidKeyboard runs on any Linux box"""
+
+    def __init__(self, path=None):
+        """path - file the reports are written to, default a new temporary file"""
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='hidg', suffix='.bin')
+            os.close(fd)
+        self.path = path
+
+    def reports(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def text(self):
+        """Everything typed so far"""
+        return decode(self.reports())
+
+    def remove(self):
+        os.remove(self.path)
@@ -31,82 +31,339 @@ try:
 except:
     from instrument import Instrument
 
-# from: https://pypi.org/project/websocket-client/
-from websocket import create_connection
-import socket
-    
+try:
+    from .pacing import OpcPacing
+except:
+    from pacing import OpcPacing
+
+try:
+    from .readings import ReadingDecoder
+except:
+    from readings import ReadingDecoder
+
+try:
+    from .profiles import parseProfiles
+except:
+    from profiles import parseProfiles
+
 class Keithley2400(Instrument):
     """Child instrument class for controlling the Keithley 2400 SourceMeter"""
 
-    def __init__(self, resource):
+    ## Any command after SYST:LOC puts the meter back into remote mode
+    _no_sync_commands = ('SYST:LOC',)
+
+    ## Keep compound commands well inside the meter's serial input buffer
+    _batch_limit = 250
+
+    ## The meter sets TRAC:FEED:CONT back to NEV by itself once the buffer is full
+    _uncached_commands = ('TRAC:FEED:CONT',)
+
+    ## Readings the trace (data store) buffer can hold
+    _TRACE_POINTS = 2500
+
+    ## Elements returned per reading, in order
+    _ELEMENTS = ('VOLT', 'CURR', 'RES', 'TIME', 'STAT')
+
+    ## Settings a measurement profile may change: speed/accuracy trade-offs
+    ## only, the trigger model and data format belong to the driver
+    _profile_settings = (
+        'SENS:VOLT:NPLC', 'SENS:CURR:NPLC', 'SENS:RES:NPLC',
+        'SENS:AVER', 'SENS:AVER:TCON', 'SENS:AVER:COUN',
+        'SENS:CURR:RANG:AUTO', 'SENS:VOLT:RANG:AUTO',
+        'SOUR:CURR:RANG:AUTO', 'SOUR:VOLT:RANG:AUTO',
+        'SOUR:DEL', 'SOUR:DEL:AUTO', 'SOUR:CLE:AUTO',
+    )
+
+    ## Used when no profiles are given: the long-standing configuration
+    _DEFAULT_PROFILES = {
+        'profiles': {
+            'default': {
+                'settings': {
+                    'SENS:VOLT:NPLC': 10,        ## high accuracy for ALL measurements - not just voltage
+                    'SOUR:CLE:AUTO': 'ON',       ## Keithley goes to idle after measurements
+                    'SENS:AVER:TCON': 'REP',     ## Repeating Filter mode
+                    'SENS:AVER:COUNT': 10,       ## Average over 10 readings when filter enabled
+                    'SENS:AVER': 'OFF',          ## let user manually enable filter if desired
+                    'SENS:CURR:RANG:AUTO': 'ON', ## Auto Range Mode for Current Measurement
+                    'SENS:VOLT:RANG:AUTO': 'ON', ## Auto Range Mode for Voltage Measurement
+                    'SOUR:DEL': 0.25,            ## Delay 0.25 seconds after enable Source and before Measuring
+                },
+            },
+        },
+    }
+
+    def __init__(self, resource, persistent=False, keepalive=None, idle_timeout=None,
+                 pacing=None, binary=False, cache=True, verify_interval=1.0,
+                 profiles=None, profile=None, timeout=None):
         """Init the class with the instrument's resource string
 
-        resource   - resource string, URI or VISA descriptor, like TCPIP0::172.16.2.13::INSTR
+        resource   - resource string, URI or VISA descriptor, like ws://wifi-uart.crozet.lan:8000,
+                     tcp://gpib-gateway:1234 or TCPIP0::172.16.2.13::INSTR (see transport.py)
+        persistent - keep the connection open between actions instead of reconnecting on every press
+        keepalive  - seconds between keepalive pings while idle (persistent mode only)
+        idle_timeout - seconds of inactivity after which the connection is re-established
+        pacing     - Pacing policy to use. Default is OpcPacing() so each command waits only until the meter is done
+        binary     - transfer readings as binary SREAL blocks instead of ASCII. The link
+                     (ie. the websocket bridge) must pass binary data through unchanged
+        cache      - skip writing settings the meter already has
+        verify_interval - seconds after which cached settings are read back before being
+                     relied on, since they can be changed from the front panel in local mode
+        profiles   - measurement profiles: path of a profiles file (see profiles.json) or dict
+                     of name to Profile. Default is a single profile with the classic settings
+        profile    - name of the profile to start with. Default is the first one
+        timeout    - seconds to wait for the connection or a reply, None to wait forever
         """
 
-        ## Number of readings to take and average over (Keithley does the averaging)
-        self._NSAMPLES=10
-
         #  single channel
-        #  wait 0.3 second between commands
         #  cmd_prefix is ':'
         #  read_termination is \n
         #  write_termination is \n
-        super(Keithley2400, self).__init__(resource, chan=1, wait=0.3,
+        super(Keithley2400, self).__init__(resource, chan=1,
                                            cmd_prefix = ':',
                                            read_termination = '\n',
-                                           write_termination = '\n')
+                                           write_termination = '\n',
+                                           persistent = persistent,
+                                           keepalive = keepalive,
+                                           idle_timeout = idle_timeout,
+                                           pacing = OpcPacing() if pacing is None else pacing,
+                                           cache = cache,
+                                           verify_interval = verify_interval,
+                                           profiles = (parseProfiles(self._DEFAULT_PROFILES)
+                                                       if profiles is None else profiles),
+                                           profile = profile,
+                                           timeout = timeout)
 
-    def _open(self, resource):
-        return create_connection(resource,sockopt=((socket.IPPROTO_TCP, socket.TCP_NODELAY,1),))    
+        ## Decodes every reply holding readings, in the format negotiated by _setup()
+        self._decoder = ReadingDecoder(self._ELEMENTS, 'SREAL' if binary else 'ASCII',
+                                       termination = self._read_termination)
 
-    def _close(self, inst):
-        inst.close()
-
-    def _query(self, inst, queryStr):
-        inst.send(queryStr)
-        return inst.recv()
-    
-    def _write(self, inst, writeStr):
-        return inst.send(writeStr)
+        ## Pre-armed triggering (see arm()): frames built once so a press
+        ## only has to send them. FETC? is followed by INIT to arm again.
+        self._armed = False
+        self._triggered = False
+        ## Set when a pre-armed exchange failed part way: the meter may still
+        ## wait for a bus trigger, so it must be disarmed before anything else
+        self._arm_unknown = False
+        self._trigger_frame = "*TRG" + self._write_termination
+        self._fetch_frame = ":FETC?;:INIT" + self._write_termination
+        self._trigger_fetch_frame = "*TRG;:FETC?;:INIT" + self._write_termination
 
     def _setup(self):
         self.open()
-        self.write("SENS:VOLT:NPLC 10") ## set to high accuracy for ALL measurements - not just voltage
-        self.write("SOUR:CLE:AUTO ON") ## Set AUTO ON mode so Keithley goes to idle after measurements
-        ##@@@self.write("SOUR:CLE:AUTO OFF") ## Set AUTO OFF mode so Keithley stays enabled after measurement
-        ##@@@self.write("ARM:COUN 6") ## set ARM Count = 6
-        self.write("ARM:COUN 1") ## set ARM Count = 1
-        self.write("ARM:SOUR IMM") ## set ARM Source = Immediate
-        ##@@@self.write("ARM:SOUR TIM") ## set ARM Source = Timer
-        ##@@@self.write("ARM:TIM 0.010") ## set ARM Timer to 10 ms
-        self.write("TRIG:COUN 1") ## set Trigger Count = 1
-        self.write("TRIG:SOUR IMM") ## set Trigger Source = Immediate
-        self.write("SENS:AVER:TCON REP") ## Repeating Filter mode
-        self.write("SENS:AVER:COUNT {}".format(self._NSAMPLES)) ## Average over NSAMPLES readings
-        ##@@@self.write("SENS:AVER ON") ## Enable Filter mode - should see FILT on display
-        self.write("SENS:AVER OFF") ## Disable Filter mode - let user manually enable if desired
-        self.write("SENS:CURR:RANG:AUTO ON") ## Enable Auto Range Mode for Current Measurement 
-        self.write("SENS:VOLT:RANG:AUTO ON") ## Enable Auto Range Mode for Voltage Measurement 
-        self.write("SOUR:DEL 0.25") ## Delay 0.25 seconds after enable Source and before Measuring
-        ##@@@self.write("SOUR:DEL:AUTO ON") ## Auto Delay after enable Source and before Measuring
-
-        ##@@@
-        #if (MODE_LOAD_CURRENT_INCR != 0):
-        #    self.write("SOUR:CURR:RANG:AUTO ON")
-
-        #@@@
-        #if (MODE_LOAD_VOLTAGE_INCR != 0):
-        #    self.write("SOUR:VOLT:RANG:AUTO ON")
+        self._disarm()
+        ## Send the configuration as a few compound commands and check the
+        ## error queue once at the end
+        with self.batch():
+            for cmd in self._decoder.commands():
+                self.write(cmd) ## reading elements and data format, see ReadingDecoder
+            ##@@@self.write("ARM:COUN 6") ## set ARM Count = 6
+            self.write("ARM:COUN 1") ## set ARM Count = 1
+            self.write("ARM:SOUR IMM") ## set ARM Source = Immediate
+            ##@@@self.write("ARM:SOUR TIM") ## set ARM Source = Timer
+            ##@@@self.write("ARM:TIM 0.010") ## set ARM Timer to 10 ms
+            self.write("TRIG:COUN 1") ## set Trigger Count = 1
+            self.write("TRIG:SOUR IMM") ## set Trigger Source = Immediate
+            ## Speed/accuracy settings (NPLC, filter, source delay) come from the active profile
+            for cmd in self._profiles[self._profile].commands:
+                self.write(cmd)
+
+            ##@@@
+            #if (MODE_LOAD_CURRENT_INCR != 0):
+            #    self.write("SOUR:CURR:RANG:AUTO ON")
+
+            #@@@
+            #if (MODE_LOAD_VOLTAGE_INCR != 0):
+            #    self.write("SOUR:VOLT:RANG:AUTO ON")
 
         ## Put instrument back in front panel input mode
         self.write("SYST:LOC")
 
         self.close()
 
+    def _selectProfile(self, name):
+        self.open()
+        self._disarm()
+        self.applyProfile(name) ## one round trip, errors checked in the same frame
+        self.write("SYST:LOC")
+        self.close()
+
     def _action(self):
         self.open()
-        result = self.query("READ?") ## read present value
+        self._disarm()
+        self.request("READ?") ## read present value
+        result = list(self._readings(1))[0]
         self.write("SYST:LOC")
         self.close()
         return result
+
+    def arm(self):
+        """Wait for a bus trigger with the measurement set up, so a press only has to trigger it
+
+        The meter stays in remote mode while armed. Needs a persistent
+        connection, which is left open. Any other action disarms first.
+        """
+        if not self._persistent:
+            raise ValueError("pre-armed triggering needs a persistent connection")
+        if self._armed:
+            return
+        self.open()
+        self._disarm()
+        with self.batch():
+            self.write("ARM:SOUR BUS") ## arm layer waits for *TRG
+            self.write("ARM:COUN 1")
+            self.write("TRIG:SOUR IMM")
+            self.write("TRIG:COUN 1")
+        ## Not paced: *OPC? would not complete until the trigger arrives
+        self._transact(self._write, self._prefix + "INIT" + self._write_termination)
+        self._armed = True
+        self._triggered = False
+
+    def _disarm(self):
+        if not self._armed and not self._arm_unknown:
+            return
+        self._armed = False
+        self._triggered = False
+        self._arm_unknown = False
+        self.write("ABOR")
+        self.write("ARM:SOUR IMM")
+
+    @property
+    def armed(self):
+        return self._armed
+
+    def shutdown(self):
+        """Disarm and return the meter to front panel control, then release the connection"""
+        if self._armed or self._arm_unknown:
+            try:
+                with self._lock:
+                    self._disarm()
+                    self.write("SYST:LOC")
+            except self._connection_errors:
+                pass  # link already gone, nothing more to tell the meter
+        super(Keithley2400, self).shutdown()
+
+    def trigger(self):
+        """Start a pre-armed measurement without waiting for it (ie. on pedal down)
+
+        Collect the reading with fetch().
+        """
+        self.arm()
+        if self._triggered:
+            return None
+        ## Not paced: *OPC? would wait for the measurement that should overlap the foot motion
+        try:
+            self._transact(self._write, self._trigger_frame)
+        except:
+            self._lostArm()
+            raise
+        self._triggered = True
+        return None
+
+    def fetch(self):
+        """Return the Reading of the measurement started by trigger() (ie. on pedal up) and arm again
+
+        Without a trigger() first, triggers and fetches with a single frame.
+        """
+        self.arm()
+        try:
+            if self._triggered:
+                self._transact(self._write, self._fetch_frame)
+            else:
+                self._transact(self._write, self._trigger_fetch_frame)
+            self._triggered = False
+            return list(self._readings(1))[0]
+        except:
+            self._lostArm()
+            raise
+
+    def _lostArm(self):
+        """Unknown whether the meter is still armed: disarm, then arm from scratch, next time
+
+        Part of a reply may also still be on its way, so the link is dropped too.
+        """
+        self._armed = False
+        self._triggered = False
+        self._arm_unknown = True
+        self._dropConnection()
+
+    def _readings(self, expected):
+        """Yield the Readings of the reply to the last request as its chunks arrive"""
+        self._decoder.reset(expected)
+        while not self._decoder.done:
+            for reading in self._decoder.feed(self.readChunk()):
+                yield reading
+
+    def stream(self, count, interval=None):
+        """Take count readings into the trace buffer and yield them as Readings
+
+        count    - number of readings, up to 2500
+        interval - seconds between readings using the arm timer, or None
+                   to take them back to back with the trigger count
+
+        The meter stores all readings itself, then they are fetched in one
+        TRAC:DATA? transfer and each Reading is yielded as soon as its
+        fields have arrived. The single-reading configuration is restored
+        when the generator finishes or is closed.
+        """
+        if not 1 <= count <= self._TRACE_POINTS:
+            raise ValueError("count must be 1 to {}".format(self._TRACE_POINTS))
+
+        self.open()
+        self._disarm()
+        requested = False
+        done = False
+        failed = True
+        try:
+            with self.batch():
+                self.write("TRAC:CLE") ## empty the buffer
+                self.write("TRAC:POIN {}".format(count)) ## buffer size
+                self.write("TRAC:FEED SENS") ## store raw readings
+                self.write("TRAC:FEED:CONT NEXT") ## fill buffer then stop
+                if interval is None:
+                    self.write("ARM:SOUR IMM")
+                    self.write("ARM:COUN 1")
+                    self.write("TRIG:COUN {}".format(count)) ## back to back readings
+                else:
+                    self.write("ARM:SOUR TIM")
+                    self.write("ARM:TIM {}".format(interval)) ## one reading per timer tick
+                    self.write("ARM:COUN {}".format(count))
+                    self.write("TRIG:COUN 1")
+
+            ## Start and wait until the buffer is full
+            self.query("INIT;*OPC?")
+
+            self.request("TRAC:DATA?")
+            requested = True
+            for reading in self._readings(count):
+                yield reading
+            done = True
+            failed = False
+
+        except GeneratorExit:
+            if requested and not done:
+                ## Closed early, so throw away the rest of the reply
+                while not self._decoder.done:
+                    self._decoder.feed(self.readChunk())
+            failed = False
+            raise
+
+        finally:
+            try:
+                if self._inst is None:
+                    self.open() ## the link was dropped by the failure
+                with self.batch():
+                    self.write("TRAC:FEED:CONT NEV")
+                    self.write("ARM:SOUR IMM")
+                    self.write("ARM:COUN 1")
+                    self.write("TRIG:COUN 1")
+                self.write("SYST:LOC")
+            except Exception:
+                if not failed:
+                    raise
+                ## Best effort only: the error already raised is the one to report
+            finally:
+                self.close()
+
+    def capture(self, count, interval=None):
+        """Take count readings (see stream()) and return them as a list of Readings"""
+        return list(self.stream(count, interval))
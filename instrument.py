@@ -27,22 +27,116 @@
 #-------------------------------------------------------------------------------
 
 import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    from .pacing import FixedPacing
+except:
+    from pacing import FixedPacing
+
+try:
+    from .scpi import commandHeader, normalizeValue, parseSetting
+except:
+    from scpi import commandHeader, normalizeValue, parseSetting
+
+try:
+    from .profiles import loadProfiles
+except:
+    from profiles import loadProfiles
+
+try:
+    from .transport import openTransport
+except:
+    from transport import openTransport
+
+try:
+    from .tracing import tracer
+except:
+    from tracing import tracer
+
+class InstrumentError(Exception):
+    """Error reported by the instrument's error queue
+
+    command - the command that caused the error, or None if it could not be determined
+    code    - numeric SCPI error code
+    message - error message from the instrument
+    """
+
+    def __init__(self, command, code, message):
+        self.command = command
+        self.code = code
+        self.message = message
+        if command is None:
+            text = "{} {}".format(code, message)
+        else:
+            text = "{} {} (from '{}')".format(code, message, command)
+        super(InstrumentError, self).__init__(text)
 
 class Instrument(object):
     """Base class for controlling and accessing an Instrument"""
 
+    ## Exceptions that indicate the connection was dropped and may be
+    ## re-established. Every transport raises ConnectionError (an OSError);
+    ## socket timeouts and other OS level failures are OSErrors too.
+    _connection_errors = (OSError,)
+
+    ## Commands that must not be followed by a *OPC? synchronization, for
+    ## example because any further command would undo them.
+    _no_sync_commands = ()
+
+    ## Largest frame, in characters including termination, that the
+    ## instrument's input buffer accepts when batching commands. None for no limit.
+    _batch_limit = None
+
+    ## Most errors to read from the error queue before giving up on emptying it
+    _max_errors = 32
+
+    ## Commands that return the instrument to a known state, emptying the settings cache
+    _reset_commands = ('*RST', 'SYST:PRES', '*RCL')
+
+    ## Settings that must always be sent, for example because the
+    ## instrument changes them on its own. Short form headers.
+    _uncached_commands = ()
+
+    ## Short form headers a measurement profile may set, or None to allow any
+    _profile_settings = None
+
     def __init__(self, resource, chan=1, wait=None, 
                  cmd_prefix = '',
                  read_termination = '',
-                 write_termination = ''):
+                 write_termination = '',
+                 persistent = False,
+                 keepalive = None,
+                 idle_timeout = None,
+                 pacing = None,
+                 cache = False,
+                 verify_interval = None,
+                 profiles = None,
+                 profile = None,
+                 timeout = None):
         """Init the class with the instrument's resource string
 
-        resource   - resource string, URI or VISA descriptor, like TCPIP0::172.16.2.13::INSTR
+        resource   - resource string, URI or VISA descriptor, like TCPIP0::172.16.2.13::INSTR.
+                     Picks the transport, see transport.py
         chan       - number of selected channel if device is multi-channel. Starts with 1
-        wait       - float that gives the default number of seconds to wait after sending each command or None if no wait
+        wait       - float that gives the default number of seconds to wait after sending each command or None if no wait.
+                     Only used by the default FixedPacing, ignored when pacing is given
         cmd_prefix - optional command prefix (ie. some instruments require a ':' prefix)
-        read_termination - optional read_termination parameter to pass to open_resource()
-        write_termination - optional write_termination parameter to pass to open_resource()
+        read_termination - end of each reply, or '' if the transport delivers whole replies
+        write_termination - appended to each command sent
+        persistent - if True, keep the connection open across open()/close() pairs until shutdown()
+        keepalive  - seconds between keepalive pings on an idle persistent connection or None for no pings
+        idle_timeout - seconds a persistent connection may sit unused before it is re-established or None for no limit
+        pacing     - Pacing policy deciding how long to hold off after each command. Default is FixedPacing(wait)
+        cache      - if True, remember the settings written and skip writes that would not change them
+        verify_interval - with cache, seconds after which the cached settings are read back
+                          before being relied on again (ie. to catch front panel changes) or None to never verify
+        profiles   - measurement profiles: path of a profiles file (see profiles.py), dict of
+                     name to Profile, or None for none
+        profile    - name of the profile setup() applies. Default is the first one
+        timeout    - seconds to wait for the connection or a reply, None to wait forever
         """
         self._resource = resource
         self._wait = wait
@@ -50,59 +144,558 @@ class Instrument(object):
         self._prefix = cmd_prefix
         self._read_termination = read_termination
         self._write_termination = write_termination
+        self._timeout = timeout
         self._inst = None        
 
+        self._persistent = persistent
+        self._keepalive = keepalive
+        self._idle_timeout = idle_timeout
+        self._last_used = 0.0
+        self._lock = threading.RLock()
+        self._keepalive_stop = threading.Event()
+        self._keepalive_thread = None
+
+        if pacing is None:
+            pacing = FixedPacing(wait)
+        self._pacing = pacing
+
+        ## Commands queued inside a batch() block, and those already sent
+        ## from it but not yet checked for errors
+        self._batch = None
+        self._batch_sent = None
+
+        ## Settings cache: short form header -> normalized value last applied
+        self._cache = cache
+        self._verify_interval = verify_interval
+        self._settings = {}
+        self._verified = 0.0
+
+        ## Measurement profiles, each precompiled into the frames that apply it
+        self._profiles = OrderedDict()
+        self._profile_frames = {}
+        self._profile = None
+        if isinstance(profiles, str):
+            profiles = loadProfiles(profiles)
+        for p in (profiles or {}).values():
+            self.addProfile(p)
+        if profile is not None:
+            if profile not in self._profiles:
+                raise ValueError("Unknown profile '{}'".format(profile))
+            self._profile = profile
+
     def open(self):
-        """Open a connection to the instrument"""
-        self._inst = self._open(self._resource)
+        """Open a connection to the instrument
+
+        In persistent mode the connection is opened lazily on first use and
+        then reused, unless it has sat idle for longer than idle_timeout.
+        """
+        with self._lock:
+            if self._inst is not None:
+                if not self._persistent:
+                    ## Left open by an action that failed part way: start afresh
+                    self._disconnect()
+                elif (self._idle_timeout is None or
+                    time.monotonic() - self._last_used < self._idle_timeout):
+                    return
+                else:
+                    self._disconnect()
+                    ## Whatever happened while away is unknown
+                    self.invalidateSettings()
+            with tracer.span('open', 'instrument', self._resource):
+                self._inst = self._open(self._resource)
+            self._last_used = time.monotonic()
+            if self._persistent and self._keepalive is not None:
+                self._startKeepalive()
 
     def close(self):
-        """Close the instrument"""
-        self._close(self._inst)
-        self._inst = None
+        """Close the instrument
+
+        In persistent mode this only ends the caller's use of the
+        connection; it stays open until shutdown() is called.
+        """
+        if self._persistent:
+            return
+        self._disconnect()
+
+    def shutdown(self):
+        """Release the connection, including a persistent one"""
+        self._stopKeepalive()
+        self._disconnect()
+
+    @property
+    def persistent(self):
+        return self._persistent
+
+    @property
+    def pacing(self):
+        return self._pacing
+
+    @pacing.setter
+    def pacing(self, pacing):
+        self._pacing = pacing
+
+    def canSync(self, cmdStr):
+        """Return True if cmdStr may be followed by a *OPC? synchronization"""
+        for part in cmdStr.split(';'):
+            if part.strip() and commandHeader(part) in self._no_sync_commands:
+                return False
+        return True
+
+    def _paced(self, cmdStr, isQuery, start):
+        """Hold off as the pacing policy says after cmdStr, sent at time.monotonic() start"""
+        elapsed = time.monotonic() - start
+        with tracer.span('pace', 'instrument', cmdStr):
+            self._pacing.paced(self, cmdStr, isQuery, elapsed)
+
+    def sync(self):
+        """Block until the instrument has completed all pending commands"""
+        return self._transact(self._query, "*OPC?" + self._write_termination)
+
+    def _disconnect(self):
+        with self._lock:
+            if self._inst is not None:
+                try:
+                    with tracer.span('close', 'instrument'):
+                        self._close(self._inst)
+                except self._connection_errors:
+                    pass  # already dropped, nothing left to release
+                self._inst = None
+
+    def _dropConnection(self):
+        """Close a link left in an unknown state and forget the cached settings
+
+        The next command opens a fresh connection, so a late reply still
+        on its way cannot answer the wrong query.
+        """
+        with self._lock:
+            self._disconnect()
+            self.invalidateSettings()
+
+    def _reconnect(self):
+        with self._lock:
+            self._disconnect()
+            self.invalidateSettings()
+            with tracer.span('reconnect', 'instrument', self._resource):
+                self._inst = self._open(self._resource)
+            self._last_used = time.monotonic()
+
+    def _transact(self, func, cmdStr):
+        """Run func(inst, cmdStr), re-establishing a dropped persistent connection once
+
+        A TimeoutError is not retried: it drops the connection and is raised,
+        as readChunk() does for any error while reading a reply.
+        """
+        with self._lock:
+            if self._persistent and self._inst is None:
+                self.open()
+            ## Named after the hook, ie. 'query' or 'write'
+            name = func.__name__.lstrip('_')
+            try:
+                with tracer.span(name, 'instrument', cmdStr):
+                    result = func(self._inst, cmdStr)
+            except TimeoutError:
+                ## The command may have been carried out, so it is never sent twice
+                self._dropConnection()
+                raise
+            except self._connection_errors:
+                if not self._persistent:
+                    raise
+                self._reconnect()
+                with tracer.span(name, 'instrument', cmdStr):
+                    result = func(self._inst, cmdStr)
+            self._last_used = time.monotonic()
+            return result
+
+    def _startKeepalive(self):
+        if self._keepalive_thread is not None and self._keepalive_thread.is_alive():
+            return
+        self._keepalive_stop.clear()
+        self._keepalive_thread = threading.Thread(target=self._keepaliveLoop,
+                                                  name="keepalive", daemon=True)
+        self._keepalive_thread.start()
+
+    def _stopKeepalive(self):
+        self._keepalive_stop.set()
+        if self._keepalive_thread is not None:
+            self._keepalive_thread.join()
+            self._keepalive_thread = None
+
+    def _keepaliveLoop(self):
+        while not self._keepalive_stop.wait(self._keepalive):
+            with self._lock:
+                if self._inst is None:
+                    continue
+                if time.monotonic() - self._last_used < self._keepalive:
+                    continue  # recent traffic already kept the link alive
+                try:
+                    self._ping(self._inst)
+                except self._connection_errors:
+                    ## Drop it now so the next command reconnects straight away,
+                    ## to an instrument that may have been reset meanwhile
+                    self._dropConnection()
 
     @property
     def channel(self):
         return self._chan
 
     def query(self, queryStr):
+        if self._batch:
+            ## Anything queued must reach the instrument before the query
+            self._flushBatch()
         queryStr = self._prefix + queryStr + self._write_termination
         #print("QUERY:",queryStr)
-        result = self._query(self._inst, queryStr)
-        if self._wait is not None:
-            time.sleep(self._wait)
+        start = time.monotonic()
+        result = self._transact(self._query, queryStr)
+        self._paced(queryStr, True, start)
         return result
         
     def write(self, writeStr):
+        if self._cache and not self._cacheWrite(writeStr):
+            return None
+        if self._batch is not None:
+            self._batch.append(writeStr)
+            return None
+        try:
+            return self._send(writeStr)
+        except:
+            self.invalidateSettings()
+            raise
+
+    def _send(self, writeStr):
         writeStr = self._prefix + writeStr + self._write_termination
         #print("WRITE:",writeStr)
-        result = self._write(self._inst, writeStr)
-        if self._wait is not None:
-            time.sleep(self._wait)
+        start = time.monotonic()
+        result = self._transact(self._write, writeStr)
+        self._paced(writeStr, False, start)
         return result
 
+    @contextmanager
+    def batch(self, check=True):
+        """Queue every write() inside the block and send them as compound commands
+
+        On leaving the block the queued writes are joined with ';' into as
+        few frames as the instrument's input buffer allows. If check is
+        True the error queue is then read once; see write_many().
+        """
+        if self._batch is not None:
+            ## Nested: the outermost block sends everything
+            yield self
+            return
+        if self._cache:
+            self._checkSettings()
+        self._batch = []
+        self._batch_sent = []
+        try:
+            yield self
+            cmds = self._batch
+            sent = self._batch_sent + cmds
+            self._batch = None
+            if check and sent:
+                ## The error query rides in the last frame: no extra round trip
+                self._writeChecked(self.packCommands(cmds + ["SYST:ERR?"]), sent)
+            else:
+                self.write_many(cmds, check=False)
+        except InstrumentError:
+            raise
+        except:
+            ## Unknown which of the queued settings took effect
+            self.invalidateSettings()
+            raise
+        finally:
+            self._batch = None
+            self._batch_sent = None
+
+    def _flushBatch(self):
+        cmds = self._batch
+        self._batch = []
+        self.write_many(cmds, check=False)
+        self._batch_sent.extend(cmds)
+        ## Queries still interleave correctly, keep batching after them
+        self._batch = []
+
+    def packCommands(self, cmds):
+        """Return the list of frames that write_many() would send for cmds"""
+        frames = []
+        frame = ''
+        for cmd in cmds:
+            cmd = self._prefix + cmd
+            if not frame:
+                candidate = cmd
+            else:
+                candidate = frame + ';' + cmd
+            if (frame and self._batch_limit is not None and
+                len(candidate) + len(self._write_termination) > self._batch_limit):
+                frames.append(frame + self._write_termination)
+                frame = cmd
+            else:
+                frame = candidate
+        if frame:
+            frames.append(frame + self._write_termination)
+        return frames
+
+    def writeFrames(self, frames):
+        """Send frames already built by packCommands()"""
+        for frame in frames:
+            start = time.monotonic()
+            self._transact(self._write, frame)
+            self._paced(frame, False, start)
+
+    def write_many(self, cmds, check=True):
+        """Send cmds as ';'-joined compound commands in as few frames as possible
+
+        If check is True, the error queue is read once afterwards and an
+        InstrumentError is raised for the first error; see checkErrors().
+        """
+        cmds = list(cmds)
+        if check and cmds:
+            self._writeChecked(self.packCommands(cmds + ["SYST:ERR?"]), cmds)
+        else:
+            self.writeFrames(self.packCommands(cmds))
+
+    def _writeChecked(self, frames, cmds):
+        """Send frames, the last ending in SYST:ERR?, and raise InstrumentError for any error"""
+        self.writeFrames(frames[:-1])
+        start = time.monotonic()
+        reply = self._transact(self._query, frames[-1])
+        self._paced(frames[-1], True, start)
+        code, message = self._parseError(reply)
+        if code != 0:
+            self._raiseErrors([(code, message)] + self.errors(), cmds)
+
+    def errors(self):
+        """Read and empty the instrument error queue. Return list of (code, message)"""
+        errors = []
+        for i in range(self._max_errors):
+            reply = self.query("SYST:ERR?")
+            code, message = self._parseError(reply)
+            if code == 0:
+                break
+            errors.append((code, message))
+        return errors
+
+    def checkErrors(self, cmds=None):
+        """Raise InstrumentError if the error queue is not empty
+
+        cmds - the commands sent since the error queue was last empty. If
+               there are errors, they are re-sent one at a time, checking
+               the error queue after each, to find the command at fault.
+               Only pass commands that are safe to repeat (ie. settings).
+        """
+        errors = self.errors()
+        if errors:
+            self._raiseErrors(errors, cmds)
+
+    def _raiseErrors(self, errors, cmds):
+        ## A setting was refused, so the cache may hold values never applied
+        self.invalidateSettings()
+        if cmds:
+            for cmd in cmds:
+                self._send(cmd)
+                culprit = self.errors()
+                if culprit:
+                    code, message = culprit[0]
+                    raise InstrumentError(cmd, code, message)
+        code, message = errors[0]
+        raise InstrumentError(None, code, message)
+
+    def _parseError(self, reply):
+        code, _, message = str(reply).strip().partition(',')
+        return int(code), message.strip().strip('"')
+
+    def _cacheWrite(self, writeStr):
+        """Update the settings cache for writeStr. Return False if it need not be sent"""
+        parts = [part for part in writeStr.split(';') if part.strip()]
+        if len(parts) != 1:
+            ## Compound command: forget what it touches, always send it
+            for part in parts:
+                self._settings.pop(commandHeader(part), None)
+            return True
+        header = commandHeader(writeStr)
+        if header in self._reset_commands:
+            self.invalidateSettings()
+            return True
+        setting = parseSetting(writeStr)
+        if setting is None or setting[0] in self._uncached_commands:
+            return True
+        if self._batch is None:
+            self._checkSettings()
+        header, value = setting
+        if self._settings.get(header) == value:
+            return False
+        self._settings[header] = value
+        return True
+
+    def _checkSettings(self):
+        if not self._settings:
+            ## Nothing cached to go stale: whatever is written from now on is current
+            self._verified = time.monotonic()
+        elif (self._verify_interval is not None and
+            time.monotonic() - self._verified >= self._verify_interval):
+            self.verifySettings()
+
+    def verifySettings(self):
+        """Read back every cached setting and correct the cache where the instrument differs
+
+        One compound query per frame. Return the list of headers that had changed.
+        """
+        headers = list(self._settings)
+        changed = []
+        frames = self.packCommands([header + '?' for header in headers])
+        for frame in frames:
+            count = frame.count(';') + 1
+            reply = self._transact(self._query, frame)
+            values = str(reply).strip().split(';')
+            if len(values) != count:
+                ## Cannot line replies up with settings: trust nothing
+                self.invalidateSettings()
+                return headers
+            for header, value in zip(headers[:count], values):
+                value = normalizeValue(value)
+                if self._settings.get(header) != value:
+                    self._settings[header] = value
+                    changed.append(header)
+            headers = headers[count:]
+        self._verified = time.monotonic()
+        return changed
+
+    def invalidateSettings(self):
+        """Forget all cached settings so the next write of each is sent"""
+        self._settings = {}
+        self._verified = time.monotonic()
+
+    @property
+    def settings(self):
+        """Copy of the settings cache: short form header -> normalized value"""
+        return dict(self._settings)
+
+    def addProfile(self, profile):
+        """Validate profile for this instrument and precompile the frames that apply it"""
+        if self._profile_settings is not None:
+            for header in profile.headers:
+                if header not in self._profile_settings:
+                    raise ValueError("Profile '{}': {} is not a profile setting of {}".format(
+                        profile.name, header, type(self).__name__))
+        self._profiles[profile.name] = profile
+        self._profile_frames[profile.name] = self.packCommands(list(profile.commands) + ["SYST:ERR?"])
+        if self._profile is None:
+            self._profile = profile.name
+
+    @property
+    def profiles(self):
+        """Names of the measurement profiles, in order"""
+        return tuple(self._profiles)
+
+    @property
+    def profile(self):
+        """Name of the active measurement profile, or None"""
+        return self._profile
+
+    def applyProfile(self, name):
+        """Send the settings of profile name, checking for errors in the same round trip
+
+        With settings cached, only the settings that differ are sent
+        (batch() reads a stale cache back first). Otherwise the
+        precompiled frames with every setting of the profile are sent as
+        they are.
+        """
+        profile = self._profiles[name]
+        if self._cache and self._settings:
+            with self.batch():
+                for cmd in profile.commands:
+                    self.write(cmd)
+        else:
+            try:
+                self._writeChecked(self._profile_frames[name], profile.commands)
+            except:
+                self.invalidateSettings()
+                raise
+            if self._cache:
+                for header, value in profile.values:
+                    if header not in self._uncached_commands:
+                        self._settings[header] = value
+                ## The cache holds nothing but what was just written and checked
+                self._verified = time.monotonic()
+        self._profile = name
+
+    def selectProfile(self, name):
+        """Make profile name the active one and apply it. Returns the Profile"""
+        if name not in self._profiles:
+            raise ValueError("Unknown profile '{}'".format(name))
+        self._selectProfile(name)
+        return self._profiles[name]
+
+    def stepProfile(self, step=1):
+        """Select the profile step places after the active one, wrapping around. Returns the Profile"""
+        if not self._profiles:
+            raise ValueError("No profiles defined")
+        names = list(self._profiles)
+        index = names.index(self._profile) if self._profile in names else 0
+        return self.selectProfile(names[(index + step) % len(names)])
+
+    def request(self, queryStr):
+        """Send a query without reading its reply, which is then collected with readChunk()
+
+        No pacing is applied since the reply has not been read yet.
+        """
+        queryStr = self._prefix + queryStr + self._write_termination
+        return self._transact(self._write, queryStr)
+
+    def readChunk(self):
+        """Return the next piece of reply data as it arrives from the instrument
+
+        A reply cannot be asked for again, so a dropped link (or a timeout,
+        which is an OSError) is not retried: the connection is closed and
+        the error raised. The next command then starts on a fresh link,
+        with no dead transport or stale reply left over.
+        """
+        with self._lock, tracer.span('read', 'instrument'):
+            try:
+                result = self._read(self._inst)
+            except self._connection_errors:
+                self._dropConnection()
+                raise
+            self._last_used = time.monotonic()
+            return result
+
     def setup(self):
         return self._setup()
     
     def action(self):
-        """Perform the instrument action (read, stop, screen capture, etc) and return the string to be sent ot computer via USB HID"""
+        """Perform the instrument action (read, stop, screen capture, etc) and return its result (ie. a Reading, which footswitch types on the computer via USB HID)"""
         return self._action()
     
-    # Each Child Class must define the following specific to themselves
+    # The connection is a Transport picked from the resource string. Child
+    # classes may override these for instruments that need something else.
     def _open(self, resource):
-        raise RuntimeError("_open() not defined by child instrument")
+        return openTransport(resource, self._read_termination, self._timeout)
 
     def _close(self, inst):
-        raise RuntimeError("_close() not defined by child instrument")
+        inst.close()
 
     def _query(self, inst, queryStr):
-        raise RuntimeError("_query() not defined by child instrument")
-    
+        return inst.query(queryStr)
+
     def _write(self, inst, writeStr):
-        raise RuntimeError("_write() not defined by child instrument")
+        return inst.write(writeStr)
+
+    def _read(self, inst):
+        return inst.read()
+
+    def _ping(self, inst):
+        """Keep an idle connection alive"""
+        inst.ping()
 
+    # Each Child Class must define the following specific to themselves
     def _setup(self):
         raise RuntimeError("_setup() not defined by child instrument")
 
+    def _selectProfile(self, name):
+        """Apply profile name. Child classes may wrap this (ie. to return to local mode)"""
+        self.open()
+        try:
+            self.applyProfile(name)
+        finally:
+            self.close()
+
     def _action(self):
         raise RuntimeError("_action() not defined by child instrument")
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#-------------------------------------------------------------------------------
+#  Measurement log: write-behind binary record files, one per day
+#-------------------------------------------------------------------------------
+#
+#  <directory>/<YYYY-MM-DD>.fslog holds a 16 byte header followed by fixed
+#  size little-endian records (see RECORD). Instrument, button and profile
+#  names are stored as ids into <YYYY-MM-DD>.names, one "id<TAB>name" per
+#  line. Fixed size records let LogReader memory-map a day's file and view
+#  it as an array without parsing it.
+
+import os
+import mmap
+import time
+import struct
+import datetime
+import threading
+from collections import deque, namedtuple
+
+# numpy is optional: LogReader falls back to struct when it is missing
+try:
+    from .readings import Reading, optionalNumpy
+except:
+    from readings import Reading, optionalNumpy
+
+MAGIC = b'FSLOG\0'
+VERSION = 1
+HEADER = struct.Struct('<6sHII')
+
+## timestamp, voltage, current, resistance, time, status, instrument, button, profile, (pad)
+RECORD = struct.Struct('<dddddIHHHH')
+
+## Field names of RECORD, also used for the numpy view of a log file
+FIELDS = ('timestamp', 'voltage', 'current', 'resistance', 'time', 'status',
+          'instrument', 'button', 'profile', 'pad')
+
+## A record read back from a log file
+LogRecord = namedtuple('LogRecord', 'timestamp instrument button profile reading')
+
+## What MeasurementLog.log() does when the queue is full
+OVERFLOW_POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
+NAN = float('nan')
+
+def logPath(directory, day):
+    """Path of the log file for day (a datetime.date) in directory"""
+    return os.path.join(directory, day.isoformat() + '.fslog')
+
+class MeasurementLog(object):
+    """Persist readings without slowing down the button path
+
+    log() only puts the reading on a bounded in-memory queue. A
+    background thread takes what has queued up, packs it into records,
+    appends them to the day's file with a single write and fsyncs at
+    most every fsync_interval seconds.
+    """
+
+    def __init__(self, directory, maxsize=4096, overflow='drop-oldest', batch=256,
+                 fsync_interval=1.0):
+        """directory - where the day files are written, created if missing
+        maxsize   - readings the queue holds before the overflow policy applies
+        overflow  - 'drop-oldest' (keep the newest readings), 'drop-newest' or
+                    'block' (log() waits for room: only for callers off the button path)
+        batch     - most records written with one write()
+        fsync_interval - seconds between fsyncs of the log file
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(', '.join(OVERFLOW_POLICIES)))
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._maxsize = maxsize
+        self._overflow = overflow
+        self._batch = batch
+        self._fsync_interval = fsync_interval
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._busy = False
+        self.dropped = 0
+
+        ## Writer thread state
+        self._day = None
+        self._file = None
+        self._names = None
+        self._namesFile = None
+        self._last_fsync = 0.0
+        self._buffer = bytearray(RECORD.size * batch)
+
+        self._thread = threading.Thread(target=self._writer, name="measurementLog", daemon=True)
+        self._thread.start()
+
+    def log(self, instrument, button, reading, profile='', timestamp=None):
+        """Queue a reading for writing. Returns False if a reading was dropped to make room
+
+        instrument - name of the instrument that took the reading
+        button     - button that triggered it
+        reading    - a Reading
+        profile    - measurement configuration (ie. profile name) in effect
+        timestamp  - seconds since the epoch, default now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        item = (timestamp, instrument, button, profile, reading)
+        with self._cond:
+            if self._closed:
+                raise ValueError("log is closed")
+            kept = True
+            if len(self._queue) >= self._maxsize:
+                if self._overflow == 'drop-newest':
+                    self.dropped += 1
+                    return False
+                elif self._overflow == 'drop-oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                    kept = False
+                else:
+                    while len(self._queue) >= self._maxsize and not self._closed:
+                        self._cond.wait()
+            self._queue.append(item)
+            self._cond.notify_all()
+            return kept
+
+    def flush(self):
+        """Wait until everything queued so far is written and synced to disk"""
+        with self._cond:
+            while self._queue or self._busy:
+                self._cond.wait()
+            self._sync()
+
+    def close(self):
+        """Write what is queued, sync and stop the writer thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._sync()
+        self._closeFiles()
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    if not self._cond.wait(self._fsync_interval):
+                        self._sync()
+                if not self._queue and self._closed:
+                    return
+                items = [self._queue.popleft() for i in range(min(self._batch, len(self._queue)))]
+                self._busy = True
+                self._cond.notify_all()
+            try:
+                self._write(items)
+                if time.monotonic() - self._last_fsync >= self._fsync_interval:
+                    self._sync()
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _write(self, items):
+        count = 0
+        for timestamp, instrument, button, profile, reading in items:
+            day = datetime.date.fromtimestamp(timestamp)
+            if day != self._day:
+                self._flushBuffer(count)
+                count = 0
+                self._openDay(day)
+            RECORD.pack_into(self._buffer, count * RECORD.size, timestamp,
+                             self._value(reading.voltage), self._value(reading.current),
+                             self._value(reading.resistance), self._value(reading.time),
+                             reading.status if reading.status is not None else 0,
+                             self._nameId(instrument), self._nameId(button),
+                             self._nameId(profile), 0)
+            count += 1
+        self._flushBuffer(count)
+
+    def _flushBuffer(self, count):
+        if count:
+            ## Names first, so every id in the record file can be resolved
+            self._namesFile.flush()
+            self._file.write(memoryview(self._buffer)[:count * RECORD.size])
+            self._file.flush()
+
+    def _value(self, value):
+        return NAN if value is None else value
+
+    def _nameId(self, name):
+        name = str(name)
+        nid = self._names.get(name)
+        if nid is None:
+            nid = len(self._names)
+            self._names[name] = nid
+            self._namesFile.write("{}\t{}\n".format(nid, name))
+        return nid
+
+    def _openDay(self, day):
+        self._sync()
+        self._closeFiles()
+        path = logPath(self._directory, day)
+        self._names = readNames(path)
+        self._namesFile = open(namesPath(path), 'a')
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+        self._day = day
+
+    def _sync(self):
+        if self._file is not None:
+            self._namesFile.flush()
+            os.fsync(self._namesFile.fileno())
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+
+    def _closeFiles(self):
+        if self._file is not None:
+            self._file.close()
+            self._namesFile.close()
+            self._file = None
+            self._namesFile = None
+
+def namesPath(path):
+    return os.path.splitext(path)[0] + '.names'
+
+def readNames(path):
+    """Return dict of name to id from the names file that goes with log file path"""
+    names = {}
+    try:
+        with open(namesPath(path)) as f:
+            for line in f:
+                nid, _, name = line.rstrip('\n').partition('\t')
+                names[name] = int(nid)
+    except FileNotFoundError:
+        pass
+    return names
+
+class LogReader(object):
+    """Memory-mapped, read-only view of a day's measurement log
+
+    records is a numpy structured array (fields as in FIELDS) directly
+    on the mapped file when numpy is installed, so selecting or reducing
+    a column touches no Python objects per record. It is only valid until
+    close(); what select() returns is a copy and stays valid.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.names = {nid: name for name, nid in readNames(path).items()}
+        self._ids = {name: nid for nid, name in self.names.items()}
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError("'{}' is not a measurement log".format(path))
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, recsize, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or recsize != RECORD.size:
+            raise ValueError("'{}' is not a version {} measurement log".format(path, VERSION))
+        ## A record cut short by a crash is ignored
+        self._count = (size - HEADER.size) // RECORD.size
+        self._view = memoryview(self._map)[HEADER.size:HEADER.size + self._count * RECORD.size]
+        numpy = self._numpy = optionalNumpy()
+        if numpy is not None:
+            dtype = numpy.dtype({'names': list(FIELDS),
+                                 'formats': ['<f8'] * 5 + ['<u4', '<u2', '<u2', '<u2', '<u2']})
+            self.records = numpy.frombuffer(self._view, dtype=dtype)
+        else:
+            self.records = None
+
+    @classmethod
+    def day(cls, directory, day=None):
+        """Open the log for day (a datetime.date, default today) in directory"""
+        if day is None:
+            day = datetime.date.today()
+        return cls(logPath(directory, day))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for row in RECORD.iter_unpack(self._view):
+            yield self._record(row)
+
+    def _record(self, row):
+        timestamp, voltage, current, resistance, rtime, status, instrument, button, profile, _ = row
+        return LogRecord(timestamp, self.names.get(instrument), self.names.get(button),
+                         self.names.get(profile),
+                         Reading(voltage, current, resistance, rtime, status))
+
+    def select(self, instrument=None, button=None, profile=None, start=None, end=None):
+        """Return the records matching all given criteria
+
+        start/end bound the timestamp (seconds since the epoch, end exclusive).
+        Returns a numpy structured array when numpy is installed, otherwise
+        a list of LogRecords.
+        """
+        wanted = {}
+        for field, name in (('instrument', instrument), ('button', button), ('profile', profile)):
+            if name is not None:
+                if name not in self._ids:
+                    return self.records[:0].copy() if self.records is not None else []
+                wanted[field] = self._ids[name]
+
+        if self.records is not None:
+            mask = self._numpy.ones(len(self.records), dtype=bool)
+            for field, nid in wanted.items():
+                mask &= self.records[field] == nid
+            if start is not None:
+                mask &= self.records['timestamp'] >= start
+            if end is not None:
+                mask &= self.records['timestamp'] < end
+            ## Indexing with a mask copies, so the result does not pin the mapping
+            return self.records[mask]
+
+        index = {'instrument': 6, 'button': 7, 'profile': 8}
+        result = []
+        for row in RECORD.iter_unpack(self._view):
+            if any(row[index[field]] != nid for field, nid in wanted.items()):
+                continue
+            if (start is not None and row[0] < start) or (end is not None and row[0] >= end):
+                continue
+            result.append(self._record(row))
+        return result
+
+    def close(self):
+        """Unmap the file. Selections taken from the reader stay usable
+
+        >>> import tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> log = MeasurementLog(directory)
+        >>> log.log('dmm', 'A', Reading(1.5, 0.001, None, None, None))
+        True
+        >>> log.close()
+        >>> reader = LogReader.day(directory)
+        >>> everything, nothing = reader.select(), reader.select(instrument='scope')
+        >>> reader.close()
+        >>> len(everything), len(nothing)
+        (1, 0)
+        """
+        self.records = None
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            ## A caller still holds a view of records: the mapping goes with it
+            pass
+        self._file.close()
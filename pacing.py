@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#-------------------------------------------------------------------------------
+#  Pacing policies: how long to hold off after each command to an instrument
+#-------------------------------------------------------------------------------
+
+import time
+
+try:
+    from .scpi import commandHeader
+except:
+    from scpi import commandHeader
+
+class Pacing(object):
+    """Base class for a pacing policy
+
+    Instrument calls paced() right after each command has been sent (and,
+    for a query, its reply received). The policy returns once the
+    instrument is ready for the next command.
+    """
+
+    def paced(self, instrument, cmdStr, isQuery, elapsed):
+        """Hold off until the instrument has completed cmdStr
+
+        instrument - the Instrument that sent the command
+        cmdStr     - the command as sent, including prefix and termination
+        isQuery    - True if cmdStr was a query whose reply has been received
+        elapsed    - seconds taken to send cmdStr (and receive its reply)
+        """
+        pass
+
+class FixedPacing(Pacing):
+    """Sleep a fixed time after every command (the original behavior)"""
+
+    def __init__(self, delay):
+        """delay - seconds to sleep after each command or None for no wait"""
+        self.delay = delay
+
+    def paced(self, instrument, cmdStr, isQuery, elapsed):
+        if self.delay:
+            time.sleep(self.delay)
+
+class OpcPacing(Pacing):
+    """Follow each write with *OPC? and wait for its reply
+
+    A query reply already proves the instrument got that far, so queries
+    are not followed by *OPC?.
+    """
+
+    def paced(self, instrument, cmdStr, isQuery, elapsed):
+        if isQuery or not instrument.canSync(cmdStr):
+            return
+        instrument.sync()
+
+class AdaptivePacing(Pacing):
+    """Learn per command how long the instrument needs and sleep only that long
+
+    The first `learn` times a write with a given header is sent, and every
+    `recheck` times after that, the time to completion is measured with
+    *OPC?. In between, the policy sleeps for a running average of the
+    measured completion times scaled by `margin`, less the time it already
+    took to send the command. Queries complete when their reply arrives,
+    so they only have their round trip recorded. Writes that may not be
+    followed by *OPC? get no hold-off, as with OpcPacing.
+    """
+
+    def __init__(self, learn=3, recheck=50, margin=1.2, alpha=0.3):
+        """learn   - number of *OPC? measurements before trusting the learned delay
+        recheck - re-measure with *OPC? every this many uses, or None to never re-measure
+        margin  - factor applied to the learned delay
+        alpha   - weight of the newest sample in the running average
+        """
+        self.learn = learn
+        self.recheck = recheck
+        self.margin = margin
+        self.alpha = alpha
+        ## header -> [uses, samples, average seconds]
+        self._learned = {}
+
+    def delay(self, header):
+        """Learned completion time for header in seconds or None if not yet learned"""
+        entry = self._learned.get(header)
+        if entry is None or entry[1] < self.learn:
+            return None
+        return entry[2]
+
+    def _record(self, entry, sample):
+        if entry[1] == 0:
+            entry[2] = sample
+        else:
+            entry[2] += self.alpha * (sample - entry[2])
+        entry[1] += 1
+
+    def paced(self, instrument, cmdStr, isQuery, elapsed):
+        header = commandHeader(cmdStr)
+        entry = self._learned.setdefault(header, [0, 0, 0.0])
+        entry[0] += 1
+
+        if isQuery:
+            self._record(entry, elapsed)
+            return
+
+        if not instrument.canSync(cmdStr):
+            ## Cannot measure it and, as with OpcPacing, no hold-off: the
+            ## next synced command's round trip waits for it anyway
+            return
+
+        measure = (entry[1] < self.learn or
+                   (self.recheck is not None and entry[0] % self.recheck == 0))
+        if measure:
+            start = time.monotonic()
+            instrument.sync()
+            self._record(entry, elapsed + time.monotonic() - start)
+            return
+
+        remaining = entry[2] * self.margin - elapsed
+        if remaining > 0:
+            time.sleep(remaining)
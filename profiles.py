@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#-------------------------------------------------------------------------------
+#  Named measurement profiles: sets of instrument settings switched as a unit
+#-------------------------------------------------------------------------------
+#
+#  A profiles file is JSON:
+#
+#      {
+#          "defaults": {"SENS:AVER": "OFF", ...},
+#          "profiles": {
+#              "probe": {"description": "...", "settings": {"SENS:VOLT:NPLC": 0.01, ...}},
+#              ...
+#          }
+#      }
+#
+#  "defaults" is merged under every profile, so each profile sets the same
+#  headers and switching between them never leaves a setting behind from
+#  the previous one. Profiles keep the order they have in the file.
+
+import json
+from collections import OrderedDict
+
+try:
+    from .scpi import normalizeHeader, parseSetting
+except:
+    from scpi import normalizeHeader, parseSetting
+
+def formatValue(value):
+    """SCPI text of a setting value from a profiles file"""
+    if isinstance(value, bool):
+        return 'ON' if value else 'OFF'
+    if isinstance(value, (list, tuple)):
+        return ','.join(formatValue(item) for item in value)
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str) and value.strip():
+        return value.strip()
+    raise ValueError("Setting value {!r} is not a number, boolean, string or list".format(value))
+
+class Profile(object):
+    """A named set of settings, validated and turned into commands when created
+
+    name        - name shown on the display
+    settings    - dict of SCPI header to value (number, boolean for ON/OFF, string or list)
+    description - optional text for people reading the profiles file
+
+    commands holds the commands that apply the profile, in order, and
+    values the (short form header, normalized value) of each, as the
+    instrument's settings cache keeps them.
+    """
+
+    def __init__(self, name, settings, description=''):
+        if not settings:
+            raise ValueError("Profile '{}' has no settings".format(name))
+        self.name = name
+        self.description = description
+        commands = []
+        values = []
+        for header, value in settings.items():
+            if any(c in header for c in ';?* '):
+                raise ValueError("Profile '{}': '{}' is not a setting header".format(name, header))
+            cmd = "{} {}".format(header.lstrip(':'), formatValue(value))
+            if ';' in cmd:
+                raise ValueError("Profile '{}': value of {} contains ';'".format(name, header))
+            commands.append(cmd)
+            values.append(parseSetting(cmd))
+        self.commands = tuple(commands)
+        self.values = tuple(values)
+
+    @property
+    def headers(self):
+        """Short form headers of the settings, in order"""
+        return tuple(header for header, _ in self.values)
+
+    def __repr__(self):
+        return "Profile({!r})".format(self.name)
+
+def loadProfiles(path):
+    """Read a profiles file and return an OrderedDict of name to Profile"""
+    with open(path) as f:
+        config = json.load(f, object_pairs_hook=OrderedDict)
+    return parseProfiles(config)
+
+def parseProfiles(config):
+    """Return an OrderedDict of name to Profile from the parsed contents of a profiles file"""
+    defaults = config.get('defaults', {})
+    profiles = OrderedDict()
+    for name, spec in config.get('profiles', {}).items():
+        ## Merge on short form headers so 'SENS:AVER:COUNT' overrides 'SENSE:AVERAGE:COUNT'.
+        ## An overridden default keeps its place, since order can matter
+        ## (ie. SOUR:DEL turns SOUR:DEL:AUTO off)
+        settings = OrderedDict()
+        seen = {}
+        for header, value in list(defaults.items()) + list(spec.get('settings', {}).items()):
+            key = normalizeHeader(header)
+            if key in seen:
+                header = seen[key]
+            seen[key] = header
+            settings[header] = value
+        profiles[name] = Profile(name, settings, spec.get('description', ''))
+    if not profiles:
+        raise ValueError("No profiles defined")
+    return profiles
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#-------------------------------------------------------------------------------
+#  Decode SourceMeter readings from ASCII or binary (IEEE-488.2 block) replies
+#-------------------------------------------------------------------------------
+
+import struct
+from collections import namedtuple
+
+# numpy is optional: without it binary data is unpacked with struct instead.
+# It is imported on first use, so start-up and ASCII transfers never pay for it.
+_numpy = None
+_numpyChecked = False
+
+def optionalNumpy():
+    """Return the numpy module, imported on the first call, or None if it is not installed"""
+    global _numpy, _numpyChecked
+    if not _numpyChecked:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = None
+        _numpyChecked = True
+    return _numpy
+
+## One reading. Elements not requested with FORM:ELEM are None.
+Reading = namedtuple('Reading', 'voltage current resistance time status')
+
+## FORM:ELEM element name -> Reading field
+ELEMENT_FIELDS = {
+    'VOLT': 'voltage',
+    'CURR': 'current',
+    'RES':  'resistance',
+    'TIME': 'time',
+    'STAT': 'status',
+}
+
+## Data formats: FORM:DATA argument and bytes per value (0 for ASCII)
+FORMATS = {
+    'ASCII': ('ASC', 0),
+    'REAL':  ('REAL,32', 4),
+    'SREAL': ('SRE', 4),
+}
+
+def formatReading(reading):
+    """Return reading as the comma separated string the meter sends in ASCII format"""
+    return ','.join('{:+.6E}'.format(float(value)) for value in reading if value is not None)
+
+class ReadingDecoder(object):
+    """Turn replies to READ?, FETC? or TRAC:DATA? into Readings
+
+    Binary replies are IEEE-488.2 blocks, either definite length
+    (#<n><length><data>) or the indefinite #0<data> the 2400 sends. The
+    block data is decoded straight from the received bytes through a
+    memoryview, with numpy.frombuffer when numpy is installed, so no
+    value ever goes through Python string parsing.
+
+    feed() decodes a reply incrementally as chunks arrive; decode() and
+    columns() take a whole reply at once.
+    """
+
+    def __init__(self, elements=('VOLT', 'CURR', 'RES', 'TIME', 'STAT'), fmt='ASCII',
+                 little_endian=True, termination=b'\n'):
+        """elements - FORM:ELEM elements in the order the meter sends them
+        fmt      - 'ASCII', 'REAL' (REAL,32) or 'SREAL'
+        little_endian - request swapped (little endian) byte order, native on the Pi
+        termination   - reply termination
+        """
+        if fmt not in FORMATS:
+            raise ValueError("Unknown data format '{}'".format(fmt))
+        for element in elements:
+            if element not in ELEMENT_FIELDS:
+                raise ValueError("Unknown reading element '{}'".format(element))
+        self.elements = tuple(elements)
+        self.fmt = fmt
+        self.little_endian = little_endian
+        if isinstance(termination, str):
+            termination = termination.encode('ascii')
+        self.termination = termination
+
+        self._fields = [ELEMENT_FIELDS[element] for element in self.elements]
+        self._size = FORMATS[fmt][1]
+        self._record = self._size * len(self.elements)
+        order = '<' if little_endian else '>'
+        self._struct = struct.Struct(order + 'f' * len(self.elements))
+        ## Only binary data is decoded with numpy
+        self._numpy = optionalNumpy() if self._size else None
+        if self._numpy is not None:
+            self._dtype = self._numpy.dtype([(field, order + 'f4') for field in self._fields])
+        self.reset()
+
+    @property
+    def binary(self):
+        return self._size != 0
+
+    def commands(self):
+        """SCPI commands that set the meter up to send this format"""
+        cmds = ["FORM:ELEM {}".format(','.join(self.elements)),
+                "FORM:DATA {}".format(FORMATS[self.fmt][0])]
+        if self.binary:
+            cmds.append("FORM:BORD {}".format('SWAP' if self.little_endian else 'NORM'))
+        return cmds
+
+    def reset(self, expected=None):
+        """Start decoding a new reply
+
+        expected - number of readings in the reply. Needed to find the end
+                   of an indefinite length (#0) block, which carries no length
+        """
+        self._buf = bytearray()
+        self._expected = expected
+        self._remaining = None   # data bytes left in the block, None until header parsed
+        self._fieldsSeen = []
+        self.done = False
+
+    def feed(self, chunk):
+        """Decode the next chunk of the reply and return the complete Readings in it"""
+        if self.done:
+            return []
+        if isinstance(chunk, str):
+            chunk = chunk.encode('latin-1')
+        self._buf += chunk
+        if self.binary:
+            return self._feedBinary()
+        return self._feedAscii()
+
+    def decode(self, data, expected=None):
+        """Decode a whole reply and return its list of Readings"""
+        self.reset(expected)
+        readings = self.feed(data)
+        if not self.done:
+            raise ValueError("Incomplete reply")
+        return readings
+
+    def columns(self, data, expected=None):
+        """Decode a whole binary reply into columns without building a tuple per reading
+
+        Returns a numpy structured array (one field per element, a view on
+        data) when numpy is installed, otherwise a dict of field name to
+        tuple of values.
+        """
+        if not self.binary:
+            readings = self.decode(data, expected)
+            return {field: tuple(getattr(r, field) for r in readings) for field in self._fields}
+
+        view = memoryview(data)
+        start, length = self._parseHeader(view, expected)
+        if length is None:
+            raise ValueError("Indefinite length block needs the expected number of readings")
+        view = view[start:start + (length // self._record) * self._record]
+        if self._numpy is not None:
+            return self._numpy.frombuffer(view, dtype=self._dtype)
+        values = [self._struct.unpack_from(view, offset)
+                  for offset in range(0, len(view), self._record)]
+        return {field: tuple(v[i] for v in values) for i, field in enumerate(self._fields)}
+
+    def _parseHeader(self, buf, expected):
+        """Return (data offset, data length) of the block in buf, (None, None) if incomplete
+
+        Data length is None for an indefinite block with no expected count.
+        """
+        if len(buf) < 2:
+            return None, None
+        if buf[0] != ord('#'):
+            raise ValueError("Reply is not an IEEE-488.2 block")
+        digits = buf[1] - ord('0')
+        if not 0 <= digits <= 9:
+            raise ValueError("Bad IEEE-488.2 block header")
+        if digits == 0:
+            if expected is None:
+                return 2, None
+            return 2, expected * self._record
+        if len(buf) < 2 + digits:
+            return None, None
+        return 2 + digits, int(bytes(buf[2:2 + digits]))
+
+    def _feedBinary(self):
+        if self._remaining is None:
+            start, length = self._parseHeader(self._buf, self._expected)
+            if start is None:
+                return []
+            del self._buf[:start]
+            self._remaining = length
+
+        available = len(self._buf)
+        if self._remaining is not None:
+            available = min(available, self._remaining)
+        nbytes = (available // self._record) * self._record
+        readings = self._unpack(memoryview(self._buf)[:nbytes])
+        del self._buf[:nbytes]
+
+        if self._remaining is not None:
+            self._remaining -= nbytes
+            if self._remaining < self._record and len(self._buf) >= self._remaining + len(self.termination):
+                ## Block and its termination are both in, nothing of this reply is left unread
+                self._buf.clear()
+                self.done = True
+        elif bytes(self._buf) == self.termination:
+            ## Indefinite block of unknown size: ends when only the termination is left
+            self.done = True
+        return readings
+
+    def _unpack(self, view):
+        if not view:
+            return []
+        if self._numpy is not None:
+            rows = self._numpy.frombuffer(view, dtype=self._dtype).tolist()
+        else:
+            rows = self._struct.iter_unpack(view)
+        return [self._reading(row) for row in rows]
+
+    def _feedAscii(self):
+        end = self._buf.find(self.termination)
+        if end >= 0:
+            text = bytes(self._buf[:end]).decode('ascii')
+            self._buf.clear()
+            self.done = True
+        else:
+            ## Keep the last, possibly incomplete, value for the next chunk
+            cut = self._buf.rfind(b',') + 1
+            text = bytes(self._buf[:cut]).decode('ascii')
+            del self._buf[:cut]
+        readings = []
+        values = self._fieldsSeen
+        for part in text.split(','):
+            if part:
+                values.append(float(part))
+                if len(values) == len(self.elements):
+                    readings.append(self._reading(values))
+                    values = self._fieldsSeen = []
+        return readings
+
+    def _reading(self, values):
+        fields = dict(zip(self._fields, values))
+        if 'status' in fields:
+            fields['status'] = int(fields['status'])
+        return Reading(fields.get('voltage'), fields.get('current'), fields.get('resistance'),
+                       fields.get('time'), fields.get('status'))
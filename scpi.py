@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#-------------------------------------------------------------------------------
+#  SCPI command text helpers
+#-------------------------------------------------------------------------------
+
+def shortForm(node):
+    """SCPI short form of one header node (ie. 'COUNt' -> 'COUN', 'DELay' -> 'DEL')
+
+    The short form is the first four characters, or the first three when
+    the fourth is a vowel. A numeric suffix is kept, so numbered nodes
+    stay apart:
+
+    >>> shortForm('CALCulate2'), shortForm('CALC2'), shortForm('CALC')
+    ('CALC2', 'CALC2', 'CALC')
+    >>> shortForm('SOURce2') != shortForm('SOURce')
+    True
+    """
+    node = node.upper()
+    if node.startswith('*'):
+        return node
+    stem = node.rstrip('0123456789')
+    suffix = node[len(stem):]
+    if len(stem) > 4:
+        stem = stem[:3] if stem[3] in 'AEIOU' else stem[:4]
+    return stem + suffix
+
+def normalizeHeader(header):
+    """Short form of a whole header, without leading ':' (ie. ':SENSe:AVERage:COUNt' -> 'SENS:AVER:COUN')"""
+    query = header.endswith('?')
+    header = header.strip().lstrip(':').rstrip('?')
+    header = ':'.join(shortForm(node) for node in header.split(':'))
+    return header + '?' if query else header
+
+def commandHeader(cmdStr):
+    """Return the normalized SCPI header of cmdStr (ie. 'SENS:VOLT:NPLC' for ':SENSe:VOLT:NPLC 10\\n')"""
+    return normalizeHeader(cmdStr.strip().split(None, 1)[0])
+
+def normalizeValue(value):
+    """Canonical form of a setting's value so written and queried values compare equal
+
+    Numbers become floats, ON/OFF become 1.0/0.0 and keywords become
+    their short form. Lists are normalized item by item into a tuple.
+    """
+    value = value.strip()
+    if value.startswith(('"', "'")):
+        return value
+    items = value.split(',')
+    if len(items) > 1:
+        return tuple(normalizeValue(item) for item in items)
+    upper = value.upper()
+    if upper == 'ON':
+        return 1.0
+    if upper == 'OFF':
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return shortForm(upper)
+
+def parseSetting(cmd):
+    """Return (normalized header, normalized value) if cmd sets a value, else None
+
+    Queries, common (*) commands and commands without an argument are not settings.
+    """
+    cmd = cmd.strip()
+    header, _, arg = cmd.partition(' ')
+    if not arg.strip() or header.endswith('?') or header.lstrip(':').startswith('*'):
+        return None
+    return normalizeHeader(header), normalizeValue(arg)
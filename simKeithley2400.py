@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+#-------------------------------------------------------------------------------
+#  Simulated Keithley 2400 behind a websocket (standing in for the wifi-uart bridge) or raw socket
+#-------------------------------------------------------------------------------
+#
+#  Run stand-alone to serve on a port:
+#
+#      python simKeithley2400.py [--port 8000] [--jitter 0.005] [--drop 0.01]
+#
+#  then point Keithley2400 at ws://localhost:8000 (or, with --transport tcp,
+#  tcp://localhost:8000). Only the SCPI subset used
+#  by instKeithley2400.py is emulated. Needs nothing beyond the standard library.
+
+import time
+import random
+import socket
+import struct
+import base64
+import hashlib
+import argparse
+import threading
+import socketserver
+
+try:
+    from .scpi import normalizeHeader
+except:
+    from scpi import normalizeHeader
+
+## Power line frequency, sets how long one NPLC takes
+LINE_FREQUENCY = 60.0
+
+_WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+class SimKeithley2400(object):
+    """SCPI behavior of a Keithley 2400, including how long it takes to measure
+
+    speed scales every instrument delay (2.0 runs twice as fast as a real meter).
+    """
+
+    ## Settings after *RST, keyed by short form header
+    DEFAULTS = {
+        'SENS:VOLT:NPLC': '1', 'SENS:CURR:NPLC': '1', 'SENS:RES:NPLC': '1',
+        'SOUR:CLE:AUTO': '0', 'SOUR:DEL': '0.001', 'SOUR:DEL:AUTO': '1',
+        'ARM:COUN': '1', 'ARM:SOUR': 'IMM', 'ARM:TIM': '0.1',
+        'TRIG:COUN': '1', 'TRIG:SOUR': 'IMM', 'TRIG:DEL': '0',
+        'SENS:AVER:TCON': 'REP', 'SENS:AVER:COUN': '10', 'SENS:AVER': '0',
+        'SENS:CURR:RANG:AUTO': '1', 'SENS:VOLT:RANG:AUTO': '1',
+        'SOUR:CURR:RANG:AUTO': '1', 'SOUR:VOLT:RANG:AUTO': '1',
+        'FORM:ELEM': 'VOLT,CURR,RES,TIME,STAT', 'FORM:DATA': 'ASC', 'FORM:BORD': 'NORM',
+        'TRAC:POIN': '100', 'TRAC:FEED': 'SENS', 'TRAC:FEED:CONT': 'NEV',
+    }
+
+    ## Commands that are accepted and need no emulation
+    NO_OPS = ('SYST:LOC', 'SYST:REM', '*CLS', 'TRAC:CLE', 'ABOR')
+
+    def __init__(self, speed=1.0, seed=None):
+        self.speed = speed
+        self._random = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.settings = dict(self.DEFAULTS)
+        self.errors = []
+        self.trace = []
+        self.last = []
+        self.armed = False
+        self._start = time.monotonic()
+
+    def _number(self, key):
+        value = self.settings[key]
+        if value in ('ON', 'OFF'):
+            return 1.0 if value == 'ON' else 0.0
+        return float(value)
+
+    def measureTime(self):
+        """Seconds one reading takes with the present settings"""
+        nplc = self._number('SENS:VOLT:NPLC') / LINE_FREQUENCY
+        if self._number('SENS:AVER'):
+            nplc *= self._number('SENS:AVER:COUN')
+        return (self._number('SOUR:DEL') + nplc) / self.speed
+
+    def _reading(self):
+        return (1.0 + self._random.gauss(0, 1e-4), 1.0e-3 + self._random.gauss(0, 1e-7),
+                9.91e37, time.monotonic() - self._start, 0.0)
+
+    def _measure(self):
+        """Run the arm/trigger model once and return the readings"""
+        narm = int(self._number('ARM:COUN'))
+        ntrig = int(self._number('TRIG:COUN'))
+        delay = self.measureTime() * narm * ntrig
+        if self.settings['ARM:SOUR'] == 'TIM':
+            delay = max(delay, self._number('ARM:TIM') * narm / self.speed)
+        time.sleep(delay)
+        self.last = [self._reading() for i in range(narm * ntrig)]
+        if self.settings['TRAC:FEED:CONT'] == 'NEXT':
+            room = int(self._number('TRAC:POIN')) - len(self.trace)
+            self.trace.extend(self.last[:room])
+            if len(self.trace) >= int(self._number('TRAC:POIN')):
+                self.settings['TRAC:FEED:CONT'] = 'NEV'
+        return self.last
+
+    def _format(self, readings):
+        elements = self.settings['FORM:ELEM'].split(',')
+        index = {'VOLT': 0, 'CURR': 1, 'RES': 2, 'TIME': 3, 'STAT': 4}
+        values = [r[index[e[:4]]] for r in readings for e in elements]
+        if self.settings['FORM:DATA'] == 'ASC':
+            return ','.join('{:+.6E}'.format(v) for v in values) + '\n'
+        order = '<' if self.settings['FORM:BORD'] == 'SWAP' else '>'
+        return b'#0' + struct.pack(order + 'f' * len(values), *values) + b'\n'
+
+    def handle(self, message):
+        """Process a message from the client and return the list of replies (str or bytes)"""
+        replies = []
+        for line in message.split('\n'):
+            texts = []
+            for cmd in line.split(';'):
+                cmd = cmd.strip()
+                if cmd:
+                    reply = self.command(cmd)
+                    if isinstance(reply, bytes):
+                        replies.append(reply)
+                    elif reply is not None:
+                        texts.append(reply.rstrip('\n'))
+            if texts:
+                ## Replies to a compound query come back as one ';'-separated line
+                replies.append(';'.join(texts) + '\n')
+        return replies
+
+    def command(self, cmd):
+        """Process one command, returning its reply or None"""
+        header, _, arg = cmd.partition(' ')
+        query = header.endswith('?')
+        key = normalizeHeader(header.rstrip('?'))
+        arg = arg.strip().upper()
+
+        if key == '*RST':
+            self.reset()
+        elif key == '*IDN':
+            return 'KEITHLEY INSTRUMENTS INC.,MODEL 2400,0000000,C30 (simulated)\n'
+        elif key == '*OPC' and query:
+            return '1\n'
+        elif key == '*TRG':
+            if self.armed:
+                self.armed = False
+                self._measure()
+        elif key in self.NO_OPS:
+            if key == 'TRAC:CLE':
+                self.trace = []
+            elif key == 'ABOR':
+                self.armed = False
+        elif key == 'SYST:ERR' and query:
+            if self.errors:
+                return self.errors.pop(0)
+            return '0,"No error"\n'
+        elif key == 'READ' and query:
+            return self._format(self._measure())
+        elif key == 'INIT':
+            if self.settings['ARM:SOUR'] == 'BUS':
+                self.armed = True
+            else:
+                self._measure()
+        elif key == 'FETC' and query:
+            return self._format(self.last)
+        elif key == 'TRAC:DATA' and query:
+            return self._format(self.trace)
+        elif key == 'TRAC:POIN:ACT' and query:
+            return '{}\n'.format(len(self.trace))
+        elif key in self.settings:
+            if query:
+                return self.settings[key] + '\n'
+            if arg in ('ON', 'OFF'):
+                arg = '1' if arg == 'ON' else '0'
+            self.settings[key] = arg
+        else:
+            self.errors.append('-113,"Undefined header"\n')
+        return None
+
+class _Handler(socketserver.BaseRequestHandler):
+    """One websocket connection to the simulated meter"""
+
+    def handle(self):
+        server = self.server
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = b''
+        if not self._handshake(sock):
+            return
+        while True:
+            frame = self._recvFrame(sock)
+            if frame is None:
+                return
+            opcode, payload = frame
+            if opcode == 0x8:      # close
+                self._sendFrame(sock, 0x8, payload[:2])
+                return
+            if opcode == 0x9:      # ping
+                self._sendFrame(sock, 0xA, payload)
+                continue
+            if opcode not in (0x1, 0x2):
+                continue
+            if server.dropNow():
+                ## Simulate the bridge losing the link mid-session
+                sock.shutdown(socket.SHUT_RDWR)
+                return
+            for reply in server.replies(payload.decode('latin-1')):
+                if isinstance(reply, bytes):
+                    self._sendFrame(sock, 0x2, reply)
+                else:
+                    self._sendFrame(sock, 0x1, reply.encode('ascii'))
+
+    def _recvExactly(self, sock, n):
+        while len(self._buffer) < n:
+            data = sock.recv(65536)
+            if not data:
+                return None
+            self._buffer += data
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def _handshake(self, sock):
+        while b'\r\n\r\n' not in self._buffer:
+            data = sock.recv(4096)
+            if not data:
+                return False
+            self._buffer += data
+        request, self._buffer = self._buffer.split(b'\r\n\r\n', 1)
+        key = None
+        for line in request.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'sec-websocket-key':
+                key = value.strip()
+        if key is None:
+            sock.sendall(b'HTTP/1.1 400 Bad Request\r\n\r\n')
+            return False
+        accept = base64.b64encode(hashlib.sha1(key + _WS_GUID).digest())
+        sock.sendall(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                     b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        return True
+
+    def _recvFrame(self, sock):
+        """Return (opcode, payload) of the next whole message, None if the connection closed"""
+        message = b''
+        kind = 0x1
+        while True:
+            head = self._recvExactly(sock, 2)
+            if head is None:
+                return None
+            fin, opcode = head[0] & 0x80, head[0] & 0x0F
+            masked, length = head[1] & 0x80, head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack('>H', self._recvExactly(sock, 2) or b'\0\0')[0]
+            elif length == 127:
+                length = struct.unpack('>Q', self._recvExactly(sock, 8) or b'\0' * 8)[0]
+            mask = self._recvExactly(sock, 4) if masked else None
+            payload = self._recvExactly(sock, length) if length else b''
+            if payload is None or (masked and mask is None):
+                return None
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            if opcode >= 0x8:
+                return opcode, payload
+            message += payload
+            if opcode:
+                kind = opcode
+            if fin:
+                return kind, message
+
+    def _sendFrame(self, sock, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            head = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 65536:
+            head = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        try:
+            sock.sendall(head + payload)
+        except OSError:
+            pass
+
+class _TcpHandler(socketserver.BaseRequestHandler):
+    """One raw SCPI socket connection to the simulated meter, as a LAN gateway would serve it"""
+
+    def handle(self):
+        server = self.server
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = b''
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                if server.dropNow():
+                    sock.shutdown(socket.SHUT_RDWR)
+                    return
+                for reply in server.replies(line.decode('latin-1')):
+                    if not isinstance(reply, bytes):
+                        reply = reply.encode('ascii')
+                    try:
+                        sock.sendall(reply)
+                    except OSError:
+                        return
+
+## Transport name -> (handler class, URL scheme)
+HANDLERS = {
+    'ws': (_Handler, 'ws'),
+    'tcp': (_TcpHandler, 'tcp'),
+}
+
+class SimServer(socketserver.ThreadingTCPServer):
+    """Websocket (or raw SCPI socket) server in front of one SimKeithley2400
+
+    jitter    - most seconds of random delay added before each reply
+    drop      - probability that a message makes the server drop the connection
+    transport - 'ws' for a websocket like the wifi-uart bridge, 'tcp' for a raw socket
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, speed=1.0, jitter=0.0, drop=0.0, seed=None,
+                 transport='ws'):
+        handler, self.scheme = HANDLERS[transport]
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), handler)
+        self.meter = SimKeithley2400(speed=speed, seed=seed)
+        self.jitter = jitter
+        self.drop = drop
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "{}://{}:{}".format(self.scheme, host, port)
+
+    def dropNow(self):
+        """True if the connection should be dropped on this message"""
+        return bool(self.drop) and self.random.random() < self.drop
+
+    def replies(self, message):
+        """Have the meter process message and yield its replies, each after any jitter"""
+        with self.lock:
+            replies = self.meter.handle(message)
+        for reply in replies:
+            if self.jitter:
+                time.sleep(self.random.uniform(0, self.jitter))
+            yield reply
+
+    def start(self):
+        """Serve from a background thread and return self"""
+        self._thread = threading.Thread(target=self.serve_forever, name="simKeithley2400", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulated Keithley 2400 behind a websocket or raw socket")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--speed', type=float, default=1.0, help="instrument delay divisor")
+    parser.add_argument('--jitter', type=float, default=0.0, help="max seconds of reply jitter")
+    parser.add_argument('--drop', type=float, default=0.0, help="probability of dropping the link per message")
+    parser.add_argument('--transport', choices=sorted(HANDLERS), default='ws', help="how clients connect")
+    args = parser.parse_args()
+
+    server = SimServer(args.host, args.port, args.speed, args.jitter, args.drop,
+                       transport=args.transport)
+    print("Simulated Keithley 2400 on", server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#-------------------------------------------------------------------------------
+#  Pre-rendered sprites and glyphs in the panel's native RGB565 format
+#-------------------------------------------------------------------------------
+#
+#  disp.image() rotates a PIL image and converts it from RGB888 to RGB565
+#  on every call. Everything here is rotated and converted once, when the
+#  UI starts: a Sprite holds big-endian RGB565 bytes in panel orientation
+#  with the panel rectangle they go to, ready for the display's raw block
+#  write. Text made of atlas glyphs is composed by copying glyph rows into
+#  a sprite buffer, with no PIL drawing at all.
+
+from PIL import Image, ImageDraw
+
+try:
+    from .readings import optionalNumpy
+except:
+    from readings import optionalNumpy
+
+## Characters of the default glyph atlas: numbers, units and the statistics line
+READOUT_CHARS = "0123456789+-.,:=%/ eEinfaμσΩVAWsmkMnuµ"
+
+def rgb565(image):
+    """Big-endian RGB565 bytes of a PIL image, row by row"""
+    image = image.convert("RGB")
+    numpy = optionalNumpy()
+    if numpy is not None:
+        rgb = numpy.asarray(image, dtype=numpy.uint16)
+        color = ((rgb[:, :, 0] & 0xF8) << 8) | ((rgb[:, :, 1] & 0xFC) << 3) | (rgb[:, :, 2] >> 3)
+        return color.astype('>u2').tobytes()
+    data = image.tobytes()
+    out = bytearray(len(data) // 3 * 2)
+    out[0::2] = bytes((r & 0xF8) | (g >> 5) for r, g in zip(data[0::3], data[1::3]))
+    out[1::2] = bytes(((g & 0x1C) << 3) | (b >> 3) for g, b in zip(data[1::3], data[2::3]))
+    return bytes(out)
+
+class Sprite(object):
+    """RGB565 pixels for the panel rectangle rect = (x0, y0, x1, y1), x1 and y1 exclusive"""
+
+    __slots__ = ('rect', 'data')
+
+    def __init__(self, rect, data):
+        self.rect = rect
+        self.data = data
+
+class PanelGeometry(object):
+    """How the UI's image coordinates map onto the panel for a display rotation
+
+    disp.image() rotates an image by `rotation` degrees (counter-clockwise)
+    before writing it, so the panel rectangle of an image box is where the
+    box lands after that rotation.
+    """
+
+    def __init__(self, width, height, rotation):
+        """width, height - size of the UI image
+        rotation      - display rotation: 0, 90, 180 or 270
+        """
+        if rotation not in (0, 90, 180, 270):
+            raise ValueError("Rotation must be 0/90/180/270")
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+
+    def clip(self, box):
+        x0, y0, x1, y1 = box
+        return max(x0, 0), max(y0, 0), min(x1, self.width), min(y1, self.height)
+
+    def panelRect(self, box):
+        """Panel rectangle (x0, y0, x1, y1), x1 and y1 exclusive, showing image box"""
+        x0, y0, x1, y1 = box
+        w, h = x1 - x0, y1 - y0
+        if self.rotation == 0:
+            x, y = x0, y0
+        elif self.rotation == 90:
+            x, y, w, h = y0, self.width - x1, h, w
+        elif self.rotation == 180:
+            x, y = self.width - x1, self.height - y1
+        else:
+            x, y, w, h = self.height - y1, x0, h, w
+        return x, y, x + w, y + h
+
+    def toPanel(self, image):
+        """RGB565 bytes of image turned the way the panel shows it"""
+        if self.rotation:
+            image = image.rotate(self.rotation, expand=True)
+        return rgb565(image)
+
+    def sprite(self, image, box):
+        """Sprite of image (of the size of box) placed at box"""
+        return Sprite(self.panelRect(box), self.toPanel(image))
+
+    def render(self, box, draw, background=0):
+        """Sprite of box drawn by draw(ImageDraw, (x0, y0)), called once with the box origin"""
+        box = self.clip(box)
+        image = Image.new("RGB", (box[2] - box[0], box[3] - box[1]), background)
+        draw(ImageDraw.Draw(image), (box[0], box[1]))
+        return self.sprite(image, box)
+
+class GlyphAtlas(object):
+    """Characters of one font and color pre-rendered in panel format, for composing text
+
+    Glyphs are placed at their advance width, without kerning, so the
+    atlas suits numeric readouts rather than prose.
+    """
+
+    def __init__(self, geometry, font, fill="#FFFFFF", background=0, chars=READOUT_CHARS):
+        self.geometry = geometry
+        self.font = font
+        self.fill = fill
+        ascent, descent = font.getmetrics()
+        self.height = ascent + descent
+        self._blank = rgb565(Image.new("RGB", (1, 1), background))
+        ## Text runs along panel rows at 0/180 and down panel columns at 90/270;
+        ## at 90/180 it runs backwards, at 180/270 its top is at the far side
+        self._horizontal = geometry.rotation in (0, 180)
+        self._backwards = geometry.rotation in (90, 180)
+        self._upsideDown = geometry.rotation in (180, 270)
+        ## char -> (advance width, glyph as a tuple of panel rows)
+        self._glyphs = {}
+        for c in set(chars) | {' '}:
+            width = max(1, int(round(font.getlength(c))))
+            image = Image.new("RGB", (width, self.height), background)
+            ImageDraw.Draw(image).text((0, 0), c, font=font, fill=fill)
+            data = geometry.toPanel(image)
+            step = (width if self._horizontal else self.height) * 2
+            self._glyphs[c] = (width, tuple(data[i:i + step] for i in range(0, len(data), step)))
+
+    def __contains__(self, c):
+        return c in self._glyphs
+
+    def width(self, text):
+        """Width in pixels of text set in this atlas; characters it lacks count as spaces"""
+        space = self._glyphs[' '][0]
+        return sum(self._glyphs.get(c, (space,))[0] for c in text)
+
+    def compose(self, box, text):
+        """Sprite of box showing text from its top left corner
+
+        Only bytes are joined: the glyphs' panel rows and blank padding.
+        Characters that do not fit in the box are left out.
+        """
+        box = self.geometry.clip(box)
+        boxWidth, boxHeight = box[2] - box[0], box[3] - box[1]
+        if boxHeight < self.height:
+            raise ValueError("Box {} is lower than the glyphs ({} pixels)".format(box, self.height))
+
+        glyphs = []
+        textWidth = 0
+        for c in text:
+            width, rows = self._glyphs.get(c) or self._glyphs[' ']
+            if textWidth + width > boxWidth:
+                break
+            glyphs.append(rows)
+            textWidth += width
+        if self._backwards:
+            glyphs.reverse()
+
+        blank = self._blank
+        if self._horizontal:
+            ## Each panel row crosses every glyph, padded to the box width
+            pad = blank * (boxWidth - textWidth)
+            lines = [b''.join(rows[r] for rows in glyphs) for r in range(self.height)]
+            lines = [pad + line if self._backwards else line + pad for line in lines]
+            blanks = [blank * boxWidth] * (boxHeight - self.height)
+            lines = blanks + lines if self._upsideDown else lines + blanks
+        else:
+            ## The glyphs' rows follow each other, each padded to the box height
+            pad = blank * (boxHeight - self.height)
+            lines = [row for rows in glyphs for row in rows]
+            lines = [pad + line if self._upsideDown else line + pad for line in lines]
+            blanks = [blank * boxHeight] * (boxWidth - textWidth)
+            lines = blanks + lines if self._backwards else lines + blanks
+        return Sprite(self.geometry.panelRect(box), b''.join(lines))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#-------------------------------------------------------------------------------
+#  Lightweight tracing of the hot path: button, instrument and display spans
+#-------------------------------------------------------------------------------
+#
+#  Code on the hot path wraps its stages in
+#
+#      with tracer.span('write', 'instrument', cmdStr):
+#          ...
+#
+#  While tracing is disabled, span() returns a shared do-nothing context
+#  manager, so a traced stage costs one method call. Once enabled, each
+#  span's monotonic start and duration go into a preallocated ring buffer
+#  that keeps the newest `size` spans. They can be written as a Chrome
+#  trace (chrome://tracing, Perfetto) or summarized as a text histogram.
+
+import json
+import time
+import itertools
+import threading
+from array import array
+
+## Upper bounds in milliseconds of the summary histogram's buckets
+BUCKETS = (0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000)
+
+class _NullSpan(object):
+    """What span() returns while tracing is disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span(object):
+    __slots__ = ('_tracer', '_name', '_cat', '_detail', '_start')
+
+    def __init__(self, tracer, name, cat, detail):
+        self._tracer = tracer
+        self._name = name
+        self._cat = cat
+        self._detail = detail
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self._tracer.record(self._name, self._start, time.monotonic(), self._cat, self._detail)
+        return False
+
+class Tracer(object):
+    """Ring buffer of timed spans, recorded from any thread"""
+
+    def __init__(self, size=4096, enabled=False):
+        """size    - number of spans kept, the oldest are overwritten
+        enabled - record spans from the start
+        """
+        self.size = size
+        self.enabled = enabled
+        self._origin = time.monotonic()
+        self._names = [None] * size
+        self._cats = [None] * size
+        self._details = [None] * size
+        self._starts = array('d', bytes(8 * size))
+        self._durations = array('d', bytes(8 * size))
+        self._threads = array('q', bytes(8 * size))
+        ## next() on a count is atomic, so threads never share a slot
+        self._counter = itertools.count()
+        self._recorded = 0
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def span(self, name, cat='', detail=None):
+        """Context manager timing its block as span name
+
+        cat    - category, ie. the part of the program: 'ui', 'instrument', ...
+        detail - optional text shown with the span, ie. the command sent
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, detail)
+
+    def record(self, name, start, end, cat='', detail=None):
+        """Record a span from time.monotonic() start to end"""
+        n = next(self._counter)
+        i = n % self.size
+        self._names[i] = name
+        self._cats[i] = cat
+        self._details[i] = detail
+        self._starts[i] = start - self._origin
+        self._durations[i] = end - start
+        self._threads[i] = threading.get_ident()
+        self._recorded = n + 1
+
+    def clear(self):
+        """Forget the spans recorded so far"""
+        self._counter = itertools.count()
+        self._recorded = 0
+
+    def spans(self):
+        """Recorded spans, oldest first, as (name, cat, detail, start, duration, thread id)
+
+        start is in seconds since the tracer was created.
+        """
+        count = min(self._recorded, self.size)
+        first = self._recorded - count
+        spans = []
+        for n in range(first, self._recorded):
+            i = n % self.size
+            spans.append((self._names[i], self._cats[i], self._details[i],
+                          self._starts[i], self._durations[i], self._threads[i]))
+        spans.sort(key=lambda s: s[3])
+        return spans
+
+    def chromeTrace(self):
+        """The spans in Chrome's trace event format, as a dict ready for json"""
+        names = {t.ident: t.name for t in threading.enumerate()}
+        events = []
+        for name, cat, detail, start, duration, thread in self.spans():
+            event = {'name': name, 'cat': cat or 'default', 'ph': 'X', 'pid': 1, 'tid': thread,
+                     'ts': round(start * 1e6, 1), 'dur': round(duration * 1e6, 1)}
+            if detail is not None:
+                event['args'] = {'detail': str(detail).strip()}
+            events.append(event)
+        for thread in sorted(set(e['tid'] for e in events)):
+            if thread in names:
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': thread,
+                               'args': {'name': names[thread]}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        """Write the spans to path as a Chrome trace JSON file"""
+        with open(path, 'w') as f:
+            json.dump(self.chromeTrace(), f)
+
+    def summary(self):
+        """Text table per span name: count, p50/p99/max in ms and a histogram over BUCKETS"""
+        durations = {}
+        for name, cat, _, _, duration, _ in self.spans():
+            durations.setdefault((cat, name), []).append(duration * 1e3)
+        lines = ["{:<24} {:>6} {:>9} {:>9} {:>9} {}".format(
+            'span', 'count', 'p50 ms', 'p99 ms', 'max ms',
+            ''.join("{:>6}".format("<{:g}".format(b)) for b in BUCKETS) + "{:>6}".format('more'))]
+        for (cat, name), samples in sorted(durations.items()):
+            samples.sort()
+            counts = [0] * (len(BUCKETS) + 1)
+            for sample in samples:
+                counts[next((b for b, bound in enumerate(BUCKETS) if sample < bound), len(BUCKETS))] += 1
+            lines.append("{:<24} {:>6} {:>9.3f} {:>9.3f} {:>9.3f} {}".format(
+                "{}.{}".format(cat, name) if cat else name, len(samples),
+                samples[(len(samples) - 1) // 2], samples[int(round(0.99 * (len(samples) - 1)))],
+                samples[-1], ''.join("{:>6}".format(c) for c in counts)))
+        return '\n'.join(lines)
+
+## The tracer the footswitch code records into
+tracer = Tracer()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+# Copyright (c) 2021, Stephen Goadhouse <sgoadhouse@virginia.edu>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#-------------------------------------------------------------------------------
+#  Transports: how commands and replies travel between footswitch and instrument
+#-------------------------------------------------------------------------------
+#
+#  The resource string picks the transport:
+#
+#      ws://host:port/...            websocket, ie. the wifi-uart bridge
+#      tcp://host[:port]             raw SCPI socket (LAN or GPIB gateway), port 5025 by default
+#      serial:///dev/ttyUSB0?baudrate=9600   serial port (needs pyserial)
+#      TCPIP0::172.16.2.13::INSTR    anything else with '::' is a VISA resource (needs pyvisa)
+#
+#  Every transport moves bytes; the replies are split at the read
+#  termination by the shared buffering in Transport, so a reply split over
+#  several packets or websocket messages (or several replies in one) is
+#  handled the same way everywhere. Connection failures of any transport
+#  are raised as ConnectionError (an OSError), so Instrument can reconnect
+#  without knowing which library was underneath. A reply that does not come
+#  in time is raised as TimeoutError instead, which Instrument does not
+#  retry, since the command may already have been carried out. It drops the
+#  connection instead, whether the reply was read by query() or readChunk().
+
+import socket
+from urllib.parse import urlsplit, parse_qsl
+
+## Port of raw SCPI sockets on LAN instruments and gateways
+SCPI_PORT = 5025
+
+class Transport(object):
+    """Base class: buffered byte link to one instrument
+
+    Child classes implement _send(bytes), _recv() returning the next
+    non-empty chunk of bytes (blocking), close() and optionally ping().
+    """
+
+    def __init__(self, read_termination='\n'):
+        """read_termination - end of a reply, or '' if each received chunk is a whole reply"""
+        if isinstance(read_termination, str):
+            read_termination = read_termination.encode('ascii')
+        self.termination = read_termination
+        self._buffer = bytearray()
+
+    def write(self, data):
+        """Send data (str or bytes) as it is: the caller adds any write termination"""
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        self._send(data)
+
+    def read(self):
+        """Return the next bytes received, as soon as there are any"""
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            return data
+        return self._recv()
+
+    def readReply(self):
+        """Return the next reply as bytes, without its termination"""
+        if not self.termination:
+            return self.read()
+        start = 0
+        while True:
+            end = self._buffer.find(self.termination, start)
+            if end >= 0:
+                reply = bytes(self._buffer[:end])
+                del self._buffer[:end + len(self.termination)]
+                return reply
+            ## The termination may straddle two chunks
+            start = max(0, len(self._buffer) - len(self.termination) + 1)
+            self._buffer += self._recv()
+
+    def query(self, data):
+        """Send data and return the reply as a str, without its termination"""
+        self.write(data)
+        return self.readReply().decode('latin-1')
+
+    def ping(self):
+        """Keep an idle link alive. Default does nothing"""
+        pass
+
+    def close(self):
+        raise RuntimeError("close() not defined by child transport")
+
+    def _send(self, data):
+        raise RuntimeError("_send() not defined by child transport")
+
+    def _recv(self):
+        raise RuntimeError("_recv() not defined by child transport")
+
+class TcpTransport(Transport):
+    """Raw SCPI over a TCP socket: tcp://host[:port]"""
+
+    def __init__(self, resource, read_termination='\n', timeout=None):
+        super(TcpTransport, self).__init__(read_termination)
+        parts = urlsplit(resource)
+        self._sock = socket.create_connection((parts.hostname, parts.port or SCPI_PORT), timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    def _send(self, data):
+        self._sock.sendall(data)
+
+    def _recv(self):
+        data = self._sock.recv(65536)
+        if not data:
+            raise ConnectionError("connection closed by instrument")
+        return data
+
+    def close(self):
+        self._sock.close()
+
+class WebsocketTransport(Transport):
+    """SCPI carried in websocket messages (ie. the wifi-uart bridge): ws://... or wss://...
+
+    Needs websocket-client (https://pypi.org/project/websocket-client/).
+    """
+
+    def __init__(self, resource, read_termination='\n', timeout=None):
+        super(WebsocketTransport, self).__init__(read_termination)
+        import websocket
+        self._timeouts = (websocket.WebSocketTimeoutException,)
+        self._errors = (websocket.WebSocketException,)
+        try:
+            self._ws = websocket.create_connection(
+                resource, timeout=timeout,
+                sockopt=((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),))
+        except self._errors as e:
+            raise ConnectionError(str(e)) from e
+
+    def _send(self, data):
+        try:
+            self._ws.send(data.decode('latin-1'))
+        except self._errors as e:
+            raise ConnectionError(str(e)) from e
+
+    def _recv(self):
+        try:
+            data = self._ws.recv()
+        except self._timeouts as e:
+            raise TimeoutError(str(e)) from e
+        except self._errors as e:
+            raise ConnectionError(str(e)) from e
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        return data
+
+    def ping(self):
+        try:
+            self._ws.ping()
+        except self._errors as e:
+            raise ConnectionError(str(e)) from e
+
+    def close(self):
+        self._ws.close()
+
+class SerialTransport(Transport):
+    """SCPI over a serial port: serial:///dev/ttyUSB0?baudrate=9600
+
+    Query parameters are passed to serial.Serial (baudrate, bytesize,
+    parity, stopbits, xonxoff, rtscts). Needs pyserial.
+    """
+
+    _INT_OPTIONS = ('baudrate', 'bytesize')
+    _FLOAT_OPTIONS = ('stopbits',)
+    _BOOL_OPTIONS = ('xonxoff', 'rtscts', 'dsrdtr')
+
+    def __init__(self, resource, read_termination='\n', timeout=None):
+        super(SerialTransport, self).__init__(read_termination)
+        import serial
+        self._errors = (serial.SerialException,)
+        parts = urlsplit(resource)
+        options = {}
+        for key, value in parse_qsl(parts.query):
+            if key in self._INT_OPTIONS:
+                value = int(value)
+            elif key in self._FLOAT_OPTIONS:
+                value = float(value)
+            elif key in self._BOOL_OPTIONS:
+                value = value.lower() in ('1', 'true', 'on', 'yes')
+            options[key] = value
+        try:
+            self._port = serial.Serial(parts.path, timeout=timeout, **options)
+        except self._errors as e:
+            raise ConnectionError(str(e)) from e
+
+    def _send(self, data):
+        try:
+            self._port.write(data)
+        except self._errors as e:
+            raise ConnectionError(str(e)) from e
+
+    def _recv(self):
+        try:
+            ## Block for the first byte, then take whatever else has arrived
+            data = self._port.read(1)
+            if data and self._port.in_waiting:
+                data += self._port.read(self._port.in_waiting)
+        except self._errors as e:
+            raise ConnectionError(str(e)) from e
+        if not data:
+            raise TimeoutError("no reply from instrument")
+        return data
+
+    def close(self):
+        self._port.close()
+
+class VisaTransport(Transport):
+    """Any VISA resource (TCPIP0::...::INSTR, GPIB0::...::INSTR, ...). Needs pyvisa"""
+
+    def __init__(self, resource, read_termination='\n', timeout=None):
+        super(VisaTransport, self).__init__(read_termination)
+        import pyvisa
+        self._errors = (pyvisa.errors.VisaIOError,)
+        self._timeout_code = pyvisa.constants.StatusCode.error_timeout
+        try:
+            self._inst = pyvisa.ResourceManager().open_resource(resource)
+        except self._errors as e:
+            raise ConnectionError(str(e)) from e
+        ## Terminations are handled here, as for every other transport
+        self._inst.write_termination = ''
+        self._inst.read_termination = None
+        if timeout is not None:
+            self._inst.timeout = timeout * 1000.0
+
+    def _send(self, data):
+        try:
+            self._inst.write_raw(data)
+        except self._errors as e:
+            raise ConnectionError(str(e)) from e
+
+    def _recv(self):
+        try:
+            return self._inst.read_raw()
+        except self._errors as e:
+            if e.error_code == self._timeout_code:
+                raise TimeoutError(str(e)) from e
+            raise ConnectionError(str(e)) from e
+
+    def close(self):
+        self._inst.close()
+
+## URL scheme -> Transport class
+SCHEMES = {
+    'ws': WebsocketTransport,
+    'wss': WebsocketTransport,
+    'tcp': TcpTransport,
+    'serial': SerialTransport,
+}
+
+def openTransport(resource, read_termination='\n', timeout=None):
+    """Open the transport resource names (see the top of this file) and return it
+
+    timeout - seconds to wait for a connection or reply, None to wait forever
+    """
+    scheme = urlsplit(resource).scheme.lower()
+    if scheme in SCHEMES:
+        return SCHEMES[scheme](resource, read_termination, timeout)
+    if '::' in resource:
+        return VisaTransport(resource, read_termination, timeout)
+    raise ValueError("No transport for resource '{}'".format(resource))
@@ -32,22 +32,156 @@ Adafruit Blinka to support CircuitPython libraries. CircuitPython does
 not support PIL/pillow (python imaging library)!
 """
 
-import time
-import random
-from colorsys import hsv_to_rgb
 import board
-from digitalio import DigitalInOut, Direction
-from adafruit_debouncer import Debouncer
+from digitalio import DigitalInOut
 from PIL import Image, ImageDraw, ImageFont
 import adafruit_rgb_display.st7789 as st7789
 
+try:
+    from .buttonInput import ButtonInput, GpioEdgeSource
+except:
+    from buttonInput import ButtonInput, GpioEdgeSource
+
+try:
+    from .analytics import formatSummary
+except:
+    from analytics import formatSummary
+
+try:
+    from .sprites import PanelGeometry, GlyphAtlas
+except:
+    from sprites import PanelGeometry, GlyphAtlas
+
+try:
+    from .tracing import tracer
+except:
+    from tracing import tracer
+
+class Widget(object):
+    """Something drawn in a fixed box of the display, redrawn only when it changes"""
+
+    def __init__(self, box):
+        """box - (x0, y0, x1, y1) area owned by the widget, x1 and y1 exclusive"""
+        self.box = box
+        self.dirty = True
+
+    def render(self, draw):
+        """Clear the widget's box and draw the widget into it"""
+        draw.rectangle((self.box[0], self.box[1], self.box[2] - 1, self.box[3] - 1), outline=0, fill=0)
+        self._render(draw)
+        self.dirty = False
+
+    def _render(self, draw):
+        raise RuntimeError("_render() not defined by child widget")
+
+    def prerender(self, geometry):
+        """Prepare whatever the widget can show without drawing (see sprite())"""
+        pass
+
+    def sprite(self):
+        """The widget's current look as a sprites.Sprite, or None to draw it with PIL"""
+        return None
+
+class ButtonWidget(Widget):
+    """A button outline, filled while the button is pressed"""
+
+    def __init__(self, shape, xy, fill, outline):
+        """shape - 'polygon', 'rectangle' or 'ellipse' (ImageDraw method name)
+        xy    - coordinates for the ImageDraw method
+        """
+        self.shape = shape
+        self.xy = xy
+        self.fill = fill
+        self.outline = outline
+        self.pressed = False
+        if shape == 'polygon':
+            xs = [p[0] for p in xy]
+            ys = [p[1] for p in xy]
+            box = (min(xs), min(ys), max(xs) + 1, max(ys) + 1)
+        else:
+            box = (xy[0], xy[1], xy[2] + 1, xy[3] + 1)
+        super(ButtonWidget, self).__init__(box)
+
+    def set(self, pressed):
+        if pressed != self.pressed:
+            self.pressed = pressed
+            self.dirty = True
+
+    def _render(self, draw):
+        self._draw(draw, self.pressed)
+
+    def _draw(self, draw, pressed, origin=(0, 0)):
+        """Draw the button in the given state with origin as the image's top left corner"""
+        fill = self.fill if pressed else 0
+        if self.shape == 'polygon':
+            xy = [(x - origin[0], y - origin[1]) for x, y in self.xy]
+        else:
+            xy = (self.xy[0] - origin[0], self.xy[1] - origin[1],
+                  self.xy[2] - origin[0], self.xy[3] - origin[1])
+        getattr(draw, self.shape)(xy, outline=self.outline, fill=fill)
+
+    def prerender(self, geometry):
+        """Render the released and the pressed look once"""
+        self._sprites = {}
+        for pressed in (False, True):
+            self._sprites[pressed] = geometry.render(
+                self.box, lambda draw, origin: self._draw(draw, pressed, origin))
+
+    def sprite(self):
+        return getattr(self, '_sprites', {}).get(self.pressed)
+
+class TextWidget(Widget):
+    """A line of text"""
+
+    def __init__(self, box, font, fill="#FFFFFF", text=""):
+        self.font = font
+        self.fill = fill
+        self.text = text
+        super(TextWidget, self).__init__(box)
+
+    def set(self, text, fill=None):
+        if fill is None:
+            fill = self.fill
+        if text != self.text or fill != self.fill:
+            self.text = text
+            self.fill = fill
+            self.dirty = True
+
+    def _render(self, draw):
+        draw.text((self.box[0], self.box[1]), self.text, font=self.font, fill=self.fill)
+
+class GlyphTextWidget(TextWidget):
+    """A line of text composed from the glyphs of a sprites.GlyphAtlas
+
+    Suits readouts that change often: only the characters in the atlas
+    can be shown and they are spaced by their advance width.
+    """
+
+    def __init__(self, box, atlas, text=""):
+        self.atlas = atlas
+        super(GlyphTextWidget, self).__init__(box, atlas.font, atlas.fill, text)
+
+    def set(self, text):
+        super(GlyphTextWidget, self).set(text)
+
+    def sprite(self):
+        return self.atlas.compose(self.box, self.text)
+
 class UI(object):
     """ Handle display and buttons on footswitch Raspberry Pi"""
     
     def __init__(self,
                  onButtonA = None, onButtonB = None,
                  onButtonL = None, onButtonR = None,
-                 onButtonU = None, onButtonC = None, onButtonD = None):
+                 onButtonU = None, onButtonC = None, onButtonD = None,
+                 onRelease = None,
+                 inputs = None, display_interval = 0.1):
+        """onButtonX - called when button X is pressed
+        onRelease - called as onRelease(name) when any button is released
+        inputs    - ButtonInput for the buttons. Default reads the bonnet's GPIO lines
+        display_interval - longest loop() sleeps without redrawing, so changes to
+                    widgets made between presses still show up
+        """
         # Create the display
         cs_pin = DigitalInOut(board.CE0)
         dc_pin = DigitalInOut(board.D25)
@@ -66,41 +200,19 @@ class UI(object):
             baudrate=BAUDRATE,
         )
 
-        # Input pins:
-        self.button_A_pin = DigitalInOut(board.D5)
-        self.button_A_pin.direction = Direction.INPUT
-        self.button_A = Debouncer(self.button_A_pin)
+        # Input pins: edge events from the gpio character device
+        if inputs is None:
+            inputs = ButtonInput(GpioEdgeSource())
+        self.inputs = inputs
+        self.display_interval = display_interval
         self.onButtonA = onButtonA
-        
-        self.button_B_pin = DigitalInOut(board.D6)
-        self.button_B_pin.direction = Direction.INPUT
-        self.button_B = Debouncer(self.button_B_pin)
         self.onButtonB = onButtonB
-
-        self.button_L_pin = DigitalInOut(board.D27)
-        self.button_L_pin.direction = Direction.INPUT
-        self.button_L = Debouncer(self.button_L_pin)
         self.onButtonL = onButtonL
-
-        self.button_R_pin = DigitalInOut(board.D23)
-        self.button_R_pin.direction = Direction.INPUT
-        self.button_R = Debouncer(self.button_R_pin)
         self.onButtonR = onButtonR
-
-        self.button_U_pin = DigitalInOut(board.D17)
-        self.button_U_pin.direction = Direction.INPUT
-        self.button_U = Debouncer(self.button_U_pin)
         self.onButtonU = onButtonU
-
-        self.button_D_pin = DigitalInOut(board.D22)
-        self.button_D_pin.direction = Direction.INPUT
-        self.button_D = Debouncer(self.button_D_pin)
         self.onButtonD = onButtonD
-
-        self.button_C_pin = DigitalInOut(board.D4)
-        self.button_C_pin.direction = Direction.INPUT
-        self.button_C = Debouncer(self.button_C_pin)
         self.onButtonC = onButtonC
+        self.onRelease = onRelease
 
         self.udlr_fill = "#00FF00"
         self.udlr_outline = "#00FFFF"
@@ -132,105 +244,153 @@ class UI(object):
         self.draw.rectangle((0, 0, width, height), outline=0, fill=0)
 
         self.fnt = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 30)
-        
-    def loop(self):
-        while True:
-            self.button_U.update()
-            up_fill = 0
-            if not self.button_U.value:  # up pressed
-                up_fill = self.udlr_fill
-            self.draw.polygon(
-                [(40, 40), (60, 4), (80, 40)], outline=self.udlr_outline, fill=up_fill
-            )  # Up
-            if self.button_U.fell: # up pressed since last update
-                if self.onButtonU is not None:
-                    # Display the Image
-                    self.disp.image(self.image)
-                    self.onButtonU()
-
-            self.button_D.update()
-            down_fill = 0
-            if not self.button_D.value:  # down pressed
-                down_fill = self.udlr_fill
-            self.draw.polygon(
-                [(60, 120), (80, 84), (40, 84)], outline=self.udlr_outline, fill=down_fill
-            )  # down
-            if self.button_D.fell: # D pressed since last update
-                if self.onButtonD is not None:
-                    # Display the Image
-                    self.disp.image(self.image)
-                    self.onButtonD()
-
-            self.button_L.update()
-            left_fill = 0
-            if not self.button_L.value:  # left pressed
-                left_fill = self.udlr_fill
-            self.draw.polygon(
-                [(0, 60), (36, 42), (36, 81)], outline=self.udlr_outline, fill=left_fill
-            )  # left
-            if self.button_L.fell: # L pressed since last update
-                if self.onButtonL is not None:
-                    # Display the Image
-                    self.disp.image(self.image)
-                    self.onButtonL()
-
-            self.button_R.update()
-            right_fill = 0
-            if not self.button_R.value:  # right pressed
-                right_fill = self.udlr_fill
-            self.draw.polygon(
-                [(120, 60), (84, 42), (84, 82)], outline=self.udlr_outline, fill=right_fill
-            )  # right
-            if self.button_R.fell: # R pressed since last update
-                if self.onButtonR is not None:
-                    # Display the Image
-                    self.disp.image(self.image)
-                    self.onButtonR()
-
-            self.button_C.update()
-            center_fill = 0
-            if not self.button_C.value:  # center pressed
-                center_fill = self.button_fill
-            self.draw.rectangle((40, 44, 80, 80), outline=self.button_outline, fill=center_fill)  # center
-            if self.button_C.fell: # C pressed since last update
-                if self.onButtonC is not None:
-                    # Display the Image
-                    self.disp.image(self.image)
-                    self.onButtonC()
-
-            self.button_A.update()
-            A_fill = 0
-            if not self.button_A.value:  # A currently pressed
-                A_fill = self.button_fill
-            self.draw.ellipse((140, 80, 180, 120), outline=self.button_outline, fill=A_fill)  # A button
-            if self.button_A.fell: # A pressed since last update
-                if self.onButtonA is not None:
-                    # Display the Image
-                    self.disp.image(self.image)
-                    self.onButtonA()
-            
-            self.button_B.update()
-            B_fill = 0
-            if not self.button_B.value:  # B currently pressed
-                B_fill = self.button_fill
-            self.draw.ellipse((190, 40, 230, 80), outline=self.button_outline, fill=B_fill)  # B button
-            if self.button_B.fell: # B pressed since last update
-                if self.onButtonB is not None:
-                    # Display the Image
-                    self.disp.image(self.image)
-                    self.onButtonB()
-
-            # make a random color and print text
-            #rcolor = tuple(int(x * 255) for x in hsv_to_rgb(random.random(), 1, 1))
-            #self.draw.text((20, 150), "footswitch", font=self.fnt, fill=rcolor)
-            #rcolor = tuple(int(x * 255) for x in hsv_to_rgb(random.random(), 1, 1))
-            #self.draw.text((20, 180), "Hello World", font=self.fnt, fill=rcolor)
-            rcolor = tuple(int(x * 255) for x in hsv_to_rgb(random.random(), 1, 1))
-            self.draw.text((20, 210), "footswitch", font=self.fnt, fill=rcolor)
-            
-            # Display the Image
-            self.disp.image(self.image)
-
-            time.sleep(0.01)
+        self.smallFnt = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 18)
+
+        ## Button states and readout glyphs are pre-rendered in the panel's
+        ## own format, so updating them is a copy of bytes to the display
+        self.geometry = PanelGeometry(width, height, self.disp.rotation)
+        self.valueGlyphs = GlyphAtlas(self.geometry, self.smallFnt, fill="#FFFFFF")
+        self.statsGlyphs = GlyphAtlas(self.geometry, self.smallFnt, fill="#A0A0A0")
+
+        ## Retained widgets: only those whose state changed are redrawn and
+        ## only their boxes are sent to the display
+        self.buttons = [
+            ('U', ButtonWidget('polygon', [(40, 40), (60, 4), (80, 40)],
+                                         self.udlr_fill, self.udlr_outline), 'onButtonU'),
+            ('D', ButtonWidget('polygon', [(60, 120), (80, 84), (40, 84)],
+                                         self.udlr_fill, self.udlr_outline), 'onButtonD'),
+            ('L', ButtonWidget('polygon', [(0, 60), (36, 42), (36, 81)],
+                                         self.udlr_fill, self.udlr_outline), 'onButtonL'),
+            ('R', ButtonWidget('polygon', [(120, 60), (84, 42), (84, 82)],
+                                         self.udlr_fill, self.udlr_outline), 'onButtonR'),
+            ('C', ButtonWidget('rectangle', (40, 44, 80, 80),
+                                         self.button_fill, self.button_outline), 'onButtonC'),
+            ('A', ButtonWidget('ellipse', (140, 80, 180, 120),
+                                         self.button_fill, self.button_outline), 'onButtonA'),
+            ('B', ButtonWidget('ellipse', (190, 40, 230, 80),
+                                         self.button_fill, self.button_outline), 'onButtonB'),
+        ]
+        self.widgets = []
+        for _, widget, _ in self.buttons:
+            self.addWidget(widget)
+        self.buttonWidgets = {name: widget for name, widget, _ in self.buttons}
+        self.buttonCallbacks = {name: callback for name, _, callback in self.buttons}
+        self.value = self.addWidget(GlyphTextWidget((4, 124, width, 148), self.valueGlyphs))
+        self.stats = self.addWidget(GlyphTextWidget((4, 148, width, 170), self.statsGlyphs))
+        self.profile = self.addWidget(TextWidget((20, 170, width, 205), self.fnt,
+                                                 fill="#FFFF00", text=""))
+        self.title = self.addWidget(TextWidget((20, 210, width, height), self.fnt,
+                                               fill="#00FFFF", text="footswitch"))
+
+        ## The display still shows the red clear screen, so the first refresh sends everything
+        self._full_refresh = True
+
+    def addWidget(self, widget):
+        """Add a widget to be drawn on the display and return it"""
+        widget.prerender(self.geometry)
+        self.widgets.append(widget)
+        return widget
+
+    def showProfile(self, name):
+        """Show name as the active measurement profile (drawn on the next refresh)"""
+        self.profile.set(name or "")
+
+    def showStats(self, summary, unit=''):
+        """Show the latest value and its statistics (an analytics.Summary, or None to clear)"""
+        value, stats = formatSummary(summary, unit)
+        self.value.set(value)
+        self.stats.set(stats)
 
+    def refresh(self):
+        """Redraw the widgets that changed and send only their boxes to the display
 
+        Widgets with a sprite are copied to the panel as they are; the
+        others are drawn into the image and their box sent from there.
+        Sprite widgets are drawn into the image only for the first, full
+        refresh, so afterwards the image holds just the other widgets.
+        Returns the number of boxes sent; 0 means the display was left untouched.
+        """
+        if self._full_refresh:
+            self._full_refresh = False
+            with tracer.span('full refresh', 'ui'):
+                for widget in self.widgets:
+                    widget.render(self.draw)
+                self.disp.image(self.image)
+            return 1
+
+        sent = 0
+        for widget in self.widgets:
+            if not widget.dirty:
+                continue
+            sprite = widget.sprite()
+            if sprite is None:
+                with tracer.span('render', 'ui', widget.box):
+                    widget.render(self.draw)
+                self._push(widget.box)
+            else:
+                widget.dirty = False
+                self._blit(sprite)
+            sent += 1
+        return sent
+
+    def _blit(self, sprite):
+        """Copy a sprite's RGB565 bytes straight to its rectangle of the panel"""
+        x0, y0, x1, y1 = sprite.rect
+        if x0 >= x1 or y0 >= y1:
+            return
+        ## The raw block write disp.image() itself ends with: inclusive
+        ## corners, the panel's offsets are added by the driver
+        with tracer.span('blit', 'display', sprite.rect):
+            self.disp._block(x0, y0, x1 - 1, y1 - 1, sprite.data)
+
+    def _push(self, box):
+        """Send the part of the image inside box to the same place on the panel"""
+        x0, y0, x1, y1 = box = self.geometry.clip(box)
+        if x0 >= x1 or y0 >= y1:
+            return
+        ## disp.image() rotates the region in software, so its origin on the
+        ## panel is where the region's corner lands after that rotation
+        x, y, _, _ = self.geometry.panelRect(box)
+        with tracer.span('image', 'display', box):
+            self.disp.image(self.image.crop(box), x=x, y=y)
+
+    def fileno(self):
+        """File descriptor that becomes readable when a button edge arrives"""
+        return self.inputs.fileno()
+
+    def deadline(self):
+        """Seconds until poll() must run again even without a new edge, or None"""
+        return self.inputs.deadline()
+
+    def poll(self, timeout=0):
+        """Wait up to timeout seconds for button edges, run the callbacks of any pressed and redraw
+
+        timeout - seconds to wait, 0 to only handle what has already arrived,
+                  None to sleep until an edge arrives.
+        Callbacks run synchronously, so they must return quickly when
+        poll() is driven from an event loop.
+        """
+        with tracer.span('wait', 'ui'):
+            events = self.inputs.wait(timeout)
+
+        with tracer.span('poll', 'ui'):
+            for event in events:
+                self.buttonWidgets[event.name].set(event.pressed)
+                if event.pressed:
+                    callback = getattr(self, self.buttonCallbacks[event.name])
+                    if callback is not None:
+                        # Show the press before running the callback
+                        self.refresh()
+                        with tracer.span('callback', 'ui', event.name):
+                            callback()
+                elif self.onRelease is not None:
+                    self.refresh()
+                    with tracer.span('callback', 'ui', event.name):
+                        self.onRelease(event.name)
+
+            self.refresh()
+
+    def loop(self):
+        """Sleep until a button edge arrives (or display_interval passes) and handle it, forever"""
+        while True:
+            self.poll(self.display_interval)